@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from schema import NEEDED_COLUMNS
+
+# Fichier de référence des clients synthétiques
+SOURCE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fichiers tests", "application_test_2_clients.csv"
+)
+
+# Modalités courantes des principales variables catégorielles, en plus de celles du fichier de référence
+EXTRA_CATEGORIES = {
+    "NAME_CONTRACT_TYPE": ["Cash loans", "Revolving loans"],
+    "CODE_GENDER": ["F", "M"],
+    "FLAG_OWN_CAR": ["Y", "N"],
+    "FLAG_OWN_REALTY": ["Y", "N"],
+    "NAME_INCOME_TYPE": ["Working", "Commercial associate", "Pensioner", "State servant"],
+    "NAME_EDUCATION_TYPE": ["Secondary / secondary special", "Higher education", "Incomplete higher"],
+    "NAME_FAMILY_STATUS": ["Married", "Single / not married", "Civil marriage", "Separated", "Widow"],
+    "NAME_HOUSING_TYPE": ["House / apartment", "With parents", "Municipal apartment", "Rented apartment"],
+    "WEEKDAY_APPR_PROCESS_START": ["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"],
+    "ORGANIZATION_TYPE": ["Business Entity Type 3", "Self-employed", "Other", "Medicine", "Government", "School"],
+}
+
+
+@lru_cache(maxsize=None)
+def load_reference(path: str = SOURCE_FILE) -> pd.DataFrame:
+    """
+    Charge le fichier de clients servant de base aux clients synthétiques.
+    """
+    return pd.read_csv(path, index_col=0)
+
+
+def generate_applicants(
+    n: int, seed: int = 0, start_id: int = 100000, source: str = SOURCE_FILE
+) -> pd.DataFrame:
+    """
+    Génère n clients synthétiques au schéma NEEDED_COLUMNS à partir du fichier de référence.
+
+    Les valeurs numériques sont tirées autour de celles du fichier (variables binaires tirées
+    au hasard, colonnes vides du fichier tirées entre 0 et 1 avec des valeurs manquantes) et
+    les variables catégorielles parmi les modalités du fichier et EXTRA_CATEGORIES. Chaque
+    client a un SK_ID_CURR distinct.
+
+    Paramètres:
+        n: Nombre de clients
+        seed: Graine du générateur aléatoire
+        start_id: Premier SK_ID_CURR
+        source: Fichier CSV de référence
+
+    Retourne:
+        pd.DataFrame: Clients aux types du schéma
+    """
+    rng = np.random.default_rng(seed)
+    reference = load_reference(source)
+    rows = reference.iloc[rng.integers(0, len(reference), n)].reset_index(drop=True)
+
+    columns = {}
+    for col, dtype in NEEDED_COLUMNS.items():
+        values = rows[col]
+        if col == "SK_ID_CURR":
+            columns[col] = np.arange(start_id, start_id + n, dtype=np.int64)
+        elif dtype == "float64":
+            if reference[col].isna().all():
+                generated = rng.uniform(0, 1, n)
+                generated[rng.random(n) < 0.5] = np.nan
+            else:
+                generated = values.to_numpy(dtype=np.float64) * rng.lognormal(0, 0.25, n)
+            columns[col] = generated
+        elif dtype == "int64":
+            if set(reference[col].unique()) <= {0, 1}:
+                columns[col] = rng.integers(0, 2, n, dtype=np.int64)
+            else:
+                generated = values.to_numpy(dtype=np.float64) * rng.uniform(0.8, 1.2, n)
+                columns[col] = np.round(generated).astype(np.int64)
+        else:
+            categories = list(reference[col].dropna().unique()) + EXTRA_CATEGORIES.get(col, [])
+            categories = list(dict.fromkeys(categories))
+            if len(categories) == 0:
+                categories = ["XNA"]
+            generated = rng.choice(np.array(categories, dtype=object), n)
+            generated[rng.random(n) < 0.05] = np.nan
+            columns[col] = generated
+    return pd.DataFrame(columns)
+
+
+def build_standin_pipeline(n_train: int = 5000, seed: int = 0):
+    """
+    Entraîne un pipeline de remplacement ColumnTransformer + LightGBM de même structure que le
+    modèle servi, sur des clients synthétiques, pour mesurer les performances sans le registre MLflow.
+
+    Retourne:
+        Pipeline scikit-learn entraîné (étapes "columntransformer" et "lgbmclassifier")
+    """
+    from category_encoders import TargetEncoder
+    from lightgbm import LGBMClassifier
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
+
+    X = generate_applicants(n_train, seed=seed).drop(columns="SK_ID_CURR")
+    rng = np.random.default_rng(seed)
+    # Cible synthétique dépendant de quelques variables pour obtenir des arbres non triviaux
+    score = -2 * X["EXT_SOURCE_2"].fillna(0.5) - X["EXT_SOURCE_3"].fillna(0.5)
+    score = score + rng.normal(0, 0.5, n_train)
+    y = (score > np.quantile(score, 0.7)).astype(int)
+
+    amounts = [col for col in X.columns if col.startswith("AMT_")]
+    numeric = [col for col in X.columns if NEEDED_COLUMNS[col] != "object" and col not in amounts]
+    target_encoded = ["ORGANIZATION_TYPE", "OCCUPATION_TYPE"]
+    one_hot = [
+        col for col in X.columns if NEEDED_COLUMNS[col] == "object" and col not in target_encoded
+    ]
+
+    ct = ColumnTransformer(
+        [
+            ("num", SimpleImputer(strategy="median", keep_empty_features=True), numeric),
+            (
+                "amt",
+                make_pipeline(
+                    SimpleImputer(strategy="median", keep_empty_features=True),
+                    FunctionTransformer(np.log1p, feature_names_out="one-to-one"),
+                ),
+                amounts,
+            ),
+            (
+                "ohe",
+                make_pipeline(
+                    SimpleImputer(strategy="most_frequent"), OneHotEncoder(handle_unknown="ignore")
+                ),
+                one_hot,
+            ),
+            ("te", TargetEncoder(), target_encoded),
+        ]
+    )
+    pipe = make_pipeline(ct, LGBMClassifier(n_estimators=200, num_leaves=31, verbose=-1))
+    return pipe.fit(X, y)
+
+
+def register_standin_model(tracking_uri: str, model_name: str) -> None:
+    """
+    Enregistre le pipeline de remplacement dans un registre MLflow local (une version).
+    """
+    import mlflow
+    import mlflow.sklearn
+
+    mlflow.set_tracking_uri(tracking_uri)
+    with mlflow.start_run():
+        mlflow.sklearn.log_model(build_standin_pipeline(), "model", registered_model_name=model_name)
+
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def summarize(
+    latencies: List[float], status_codes: List[int], rows: int, elapsed: float, rejections: int = 0
+) -> Dict:
+    """
+    Calcule les percentiles de latence (ms) des requêtes réussies et les débits d'un scénario.
+    Les requêtes en erreur sont comptées à part, ainsi que les réponses 503 du pool saturé
+    suivies d'un nouvel essai (rejections) : un scénario dont rejection_rate n'est pas nul
+    mesure aussi l'attente avant d'être admis, pas seulement le scoring.
+    """
+    ok = [latency for latency, status_code in zip(latencies, status_codes) if status_code == 200]
+    latencies_ms = np.array(ok) * 1000
+    summary = {
+        "requests": len(latencies),
+        "errors": len(latencies) - len(ok),
+        "status_codes": {str(code): status_codes.count(code) for code in sorted(set(status_codes))},
+        "rejections": rejections,
+        "rejection_rate": rejections / (len(latencies) + rejections) if latencies else 0.0,
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(ok) / elapsed,
+        "rows_per_second": len(ok) * rows / elapsed,
+    }
+    if len(ok) == 0:
+        summary.update({f"latency_ms_{name}": None for name in ("mean", "p50", "p95", "p99", "max")})
+        return summary
+
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    summary.update(
+        {
+            "latency_ms_mean": float(latencies_ms.mean()),
+            "latency_ms_p50": float(p50),
+            "latency_ms_p95": float(p95),
+            "latency_ms_p99": float(p99),
+            "latency_ms_max": float(latencies_ms.max()),
+        }
+    )
+    return summary
+
+
+async def post_until_admitted(client, url: str, payload: bytes, max_retries: int = 50):
+    """
+    Envoie une requête /predict et la renvoie après une attente croissante tant que le pool est
+    saturé (503), comme le ferait un client respectant Retry-After.
+
+    Retourne:
+        Réponse finale et nombre de réponses 503 reçues avant celle-ci
+    """
+    backoff = 0.01
+    for retries in range(max_retries + 1):
+        response = await client.post(url, files={"file": ("benchmark.csv", payload, "text/csv")})
+        if response.status_code != 503 or retries == max_retries:
+            return response, retries
+        # Attendre de plus en plus longtemps, sans dépasser le Retry-After indiqué par l'API
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, float(response.headers.get("Retry-After", 1)))
+
+
+async def run_scenario(
+    client, explain: str, batch_size: int, concurrency: int, requests: int, seed: int
+) -> Dict:
+    """
+    Envoie requests requêtes /predict de batch_size clients distincts avec concurrency requêtes
+    simultanées et mesure la latence de chacune, du premier envoi à la réponse finale.
+    """
+    # Préparer des fichiers distincts pour ne pas mesurer le cache des prédictions
+    payloads = [
+        to_csv_bytes(generate_applicants(batch_size, seed=seed + i, start_id=1_000_000 + i * batch_size))
+        for i in range(requests)
+    ]
+    latencies: List[float] = []
+    status_codes: List[int] = []
+    rejections = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+
+    async def worker() -> None:
+        nonlocal rejections
+        while not queue.empty():
+            payload = queue.get_nowait()
+            start = time.perf_counter()
+            response, retries = await post_until_admitted(client, f"/predict?explain={explain}", payload)
+            latencies.append(time.perf_counter() - start)
+            status_codes.append(response.status_code)
+            rejections += retries
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "explain": explain,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        **summarize(latencies, status_codes, batch_size, elapsed, rejections),
+    }
+
+
+async def run_benchmark(
+    app,
+    explain_modes: List[str],
+    batch_sizes: List[int],
+    concurrency_levels: List[int],
+    requests: int,
+    seed: int,
+) -> List[Dict]:
+    """
+    Démarre l'application dans le processus courant et exécute tous les scénarios.
+    """
+    import httpx
+
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            # Attendre que l'API ait chargé et préchauffé le modèle, puis chauffer le chemin HTTP
+            while True:
+                response = await client.get("/health/ready")
+                if response.status_code == 200:
+                    break
+                if response.json()["status"] == "failed":
+                    raise RuntimeError(f"Échec du démarrage de l'API: {response.json()['detail']}")
+                await asyncio.sleep(0.1)
+            warmup = to_csv_bytes(generate_applicants(10, seed=seed))
+            await client.post("/predict", files={"file": ("warmup.csv", warmup, "text/csv")})
+
+            for explain in explain_modes:
+                for batch_size in batch_sizes:
+                    for concurrency in concurrency_levels:
+                        result = await run_scenario(client, explain, batch_size, concurrency, requests, seed)
+                        print(format_result(result), flush=True)
+                        results.append(result)
+    return results
+
+
+def format_result(result: Dict) -> str:
+    latencies = "  ".join(
+        f"{name}={result[f'latency_ms_{name}'] or float('nan'):8.1f} ms" for name in ("p50", "p95", "p99")
+    )
+    return (
+        f"{scenario_label(result)}  {latencies}  {result['rows_per_second']:9.0f} lignes/s  "
+        f"erreurs={result['errors']}"
+        + (f"  SATURÉ: {result['rejection_rate']:.0%} de 503 renvoyées" if result["rejections"] else "")
+    )
+
+
+def scenario_label(result: Dict) -> str:
+    return f"explain={result['explain']:<4} lignes={result['batch_size']:<5} concurrence={result['concurrency']:<3}"
+
+
+def compare(results: List[Dict], previous: List[Dict]) -> None:
+    """
+    Affiche l'évolution de la latence p50/p95 et du débit par rapport à des résultats précédents.
+    """
+    previous_by_key = {(r["explain"], r["batch_size"], r["concurrency"]): r for r in previous}
+    for result in results:
+        before = previous_by_key.get((result["explain"], result["batch_size"], result["concurrency"]))
+        if before is None or None in (result["latency_ms_p50"], before["latency_ms_p50"]):
+            continue
+        print(
+            f"{scenario_label(result)}  "
+            f"p50 x{result['latency_ms_p50'] / before['latency_ms_p50']:.2f}  "
+            f"p95 x{result['latency_ms_p95'] / before['latency_ms_p95']:.2f}  "
+            f"débit x{result['rows_per_second'] / max(before['rows_per_second'], 1e-9):.2f}"
+        )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(value: str, cast=int) -> list:
+    return [cast(item) for item in value.split(",") if item]
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Mesure la latence et le débit de /predict dans le processus courant, "
+        "avec un modèle de remplacement."
+    )
+    parser.add_argument("--batch-sizes", default="1,10,100,1000", help="Nombres de clients par requête")
+    parser.add_argument("--concurrency", default="1,4,16", help="Nombres de requêtes simultanées")
+    parser.add_argument("--explain", default="none,full", help="Modes d'explication mesurés")
+    parser.add_argument("--requests", type=int, default=20, help="Nombre de requêtes par scénario")
+    parser.add_argument("--seed", type=int, default=0, help="Graine des clients synthétiques")
+    parser.add_argument("--output", default="benchmark_results.json", help="Fichier JSON des résultats")
+    parser.add_argument("--compare", help="Fichier JSON de résultats précédents à comparer")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_api_") as workdir:
+        # Configurer l'API avant son import : registre MLflow local, sans cache ni surveillance du registre
+        tracking_uri = "file://" + os.path.join(workdir, "mlruns")
+        os.environ["MLFLOW_TRACKING_URI"] = tracking_uri
+        os.environ.setdefault("MODEL_POLL_INTERVAL", "0")
+        os.environ.setdefault("CACHE_MAX_ENTRIES", "0")
+        os.environ["JOBS_DIR"] = os.path.join(workdir, "jobs")
+
+        from model_registry import MODEL_NAME
+
+        register_standin_model(tracking_uri, MODEL_NAME)
+        import script_api
+
+        results = asyncio.run(
+            run_benchmark(
+                script_api.app,
+                parse_list(args.explain, str),
+                parse_list(args.batch_sizes),
+                parse_list(args.concurrency),
+                args.requests,
+                args.seed,
+            )
+        )
+
+    report = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            name: os.environ.get(name)
+            for name in (
+                "SCORING_EXECUTOR", "SCORING_WORKERS", "SCORING_MAX_QUEUE", "BATCH_WINDOW_MS", "BATCH_MAX_ROWS"
+            )
+        },
+        "requests_per_scenario": args.requests,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Résultats enregistrés dans {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import CHALLENGER_BATCHES, record_stages
+from serialization import write_atomic
+from model_registry import MODEL_NAME, ModelBundle, load_bundle
+from utilities import predict_versions, row_thresholds
+
+logger = logging.getLogger(__name__)
+
+# Colonnes des fichiers de comparaison champion / challengers
+LOG_COLUMNS = [
+    "BATCH_ID", "SCORED_AT", "ROLE", "MODEL_VERSION", "SK_ID_CURR", "PROBA_DEFAUT", "PRED_DEFAUT", "SEUIL"
+]
+
+
+def parse_versions(value: str) -> List[str]:
+    """
+    Lit une liste de versions du modèle séparées par des virgules ("3,4"), vide si value est vide.
+    """
+    return [version.strip() for version in value.split(",") if version.strip()]
+
+
+class ChallengerScorer:
+    """
+    Score en arrière-plan les lots déjà scorés par le modèle servi (champion) avec d'autres
+    versions du registre (challengers), et enregistre les deux résultats pour les comparer hors ligne.
+
+    Les lots sont scorés un par un dans un thread de fond : la réponse n'attend que le champion.
+    Les challengers dont le prétraitement est identique à celui du champion réutilisent sa matrice
+    transformée. Lorsque max_pending lots sont en attente, les suivants ne sont pas comparés
+    plutôt que de retarder les requêtes ou d'accumuler de la mémoire.
+
+    Les résultats sont écrits dans log_dir, un fichier Parquet toutes les flush_rows lignes, avec
+    les colonnes LOG_COLUMNS (ROLE vaut champion ou challenger).
+    """
+
+    def __init__(
+        self,
+        versions: List[str],
+        log_dir: str,
+        model_name: str = MODEL_NAME,
+        loader: Callable[[str, str], ModelBundle] = load_bundle,
+        product_thresholds: Tuple[Tuple[str, float], ...] = (),
+        max_pending: int = 16,
+        flush_rows: int = 10000,
+    ):
+        self.versions = [str(version) for version in versions]
+        self.log_dir = log_dir
+        self.model_name = model_name
+        self.loader = loader
+        self.product_thresholds = product_thresholds
+        self.flush_rows = flush_rows
+        self._bundles: List[ModelBundle] = []
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._frames: List[pd.DataFrame] = []
+        self._buffered_rows = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {"scored": 0, "dropped": 0, "failed": 0, "rows": 0, "files": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        """
+        Charge les versions challengers puis démarre le thread de scoring. Sans version, ne fait rien.
+        """
+        if len(self.versions) == 0:
+            return
+        self._bundles = [self.loader(version, self.model_name) for version in self.versions]
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="challengers", daemon=True)
+        self._thread.start()
+        logger.info("Versions challengers %s chargées", ", ".join(self.versions))
+
+    def stop(self) -> None:
+        """
+        Score les lots en attente, écrit les résultats restants puis arrête le thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(
+        self,
+        df: pd.DataFrame,
+        seuil: float,
+        champion_df: pd.DataFrame,
+        champion_version: str,
+        transformed: Dict[str, object] = None,
+    ) -> None:
+        """
+        Ajoute un lot scoré par le champion à la file des challengers, sans attendre.
+
+        Paramètres:
+            df: Données clients du lot
+            seuil: Seuil des produits sans seuil spécifique
+            champion_df: Résultats du champion dans l'ordre de df (colonnes PROBA_DEFAUT et PRED_DEFAUT)
+            champion_version: Version du modèle servi
+            transformed: Matrices transformées par le champion, par clé de prétraitement (optionnel)
+        """
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait((df, seuil, champion_df, champion_version, transformed))
+        except queue.Full:
+            self._count("dropped")
+
+    def submit_future(
+        self, df: pd.DataFrame, seuil: float, champion_version: str, transformed: dict, future: Future
+    ) -> None:
+        """
+        Callback de fin de scoring du pool : soumet le lot si le champion l'a scoré sans erreur.
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        champion_df = future.result()[0]
+        if isinstance(champion_df, list):
+            # Résultats du chemin à faible latence : un dictionnaire par client
+            champion_df = pd.DataFrame(champion_df, columns=["PROBA_DEFAUT", "PRED_DEFAUT"])
+        self.submit(df, seuil, champion_df, champion_version, transformed)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Retourne les versions comparées et les compteurs de lots (scorés, abandonnés, en erreur).
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        return {
+            "versions": self.versions,
+            "enabled": self.enabled,
+            "log_dir": self.log_dir,
+            "pending": self._queue.qsize(),
+            **stats,
+        }
+
+    def _count(self, outcome: str, rows: int = 0) -> None:
+        CHALLENGER_BATCHES.labels(outcome).inc()
+        with self._stats_lock:
+            self._stats[outcome] += 1
+            self._stats["rows"] += rows
+
+    def _run(self) -> None:
+        # Vider la file avant de s'arrêter pour ne perdre aucun lot accepté
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._score(*batch)
+            except Exception:
+                logger.exception("Échec du scoring des versions challengers")
+                self._count("failed")
+        self._flush()
+
+    def _score(
+        self,
+        df: pd.DataFrame,
+        seuil: float,
+        champion_df: pd.DataFrame,
+        champion_version: str,
+        transformed: Optional[dict],
+    ) -> None:
+        # Ne pas rescorer la version servie si elle fait partie des challengers
+        bundles = [bundle for bundle in self._bundles if bundle.version != champion_version]
+        if len(bundles) == 0:
+            return
+        timings: Dict[str, float] = {}
+        challengers_df = predict_versions(
+            df, seuil, bundles, self.product_thresholds, transformed=transformed, timings=timings
+        )
+        # Exporter les durées sous des étapes distinctes de celles du champion
+        record_stages({f"challenger_{stage}": seconds for stage, seconds in timings.items()})
+
+        champion_df = pd.DataFrame(
+            {
+                "SK_ID_CURR": df["SK_ID_CURR"].to_numpy(),
+                "MODEL_VERSION": champion_version,
+                "PROBA_DEFAUT": champion_df["PROBA_DEFAUT"].to_numpy(),
+                "PRED_DEFAUT": champion_df["PRED_DEFAUT"].to_numpy(),
+                "SEUIL": np.broadcast_to(row_thresholds(df, seuil, self.product_thresholds), (len(df),)),
+            }
+        )
+        log_df = pd.concat(
+            [champion_df.assign(ROLE="champion"), challengers_df.assign(ROLE="challenger")],
+            ignore_index=True,
+        ).assign(BATCH_ID=uuid.uuid4().hex, SCORED_AT=time.time())
+        log_df = log_df[LOG_COLUMNS]
+        self._frames.append(log_df)
+        self._buffered_rows += len(log_df)
+        self._count("scored", len(df))
+        if self._buffered_rows >= self.flush_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        if len(self._frames) == 0:
+            return
+        log_df = pd.concat(self._frames, ignore_index=True)
+        self._frames, self._buffered_rows = [], 0
+
+        filename = f"challengers-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        path = os.path.join(self.log_dir, filename)
+        write_atomic(path, lambda tmp_path: log_df.to_parquet(tmp_path, index=False))
+        with self._stats_lock:
+            self._stats["files"] += 1
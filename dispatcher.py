@@ -0,0 +1,211 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from metrics import add_timings, request_timings
+from scoring_pool import PoolSaturated, ScoringPool
+
+
+@dataclass
+class _PendingRequest:
+    key: tuple
+    df: pd.DataFrame
+    future: asyncio.Future
+    timings: Optional[Dict[str, float]] = None
+
+
+class MicroBatcher:
+    """
+    Regroupe les lignes de requêtes /predict concurrentes pour les scorer en un seul appel.
+
+    Le premier lot en attente ouvre une fenêtre de window_ms millisecondes pendant
+    laquelle les requêtes suivantes sont ajoutées au lot, jusqu'à max_batch_rows lignes.
+    Avec window_ms = 0, seules les requêtes déjà en attente sont regroupées.
+    Les requêtes ne sont regroupées qu'avec celles ayant les mêmes options de scoring.
+
+    Un lot n'est constitué que lorsqu'un worker du pool est libre : pendant le scoring des
+    lots précédents, les requêtes s'accumulent dans la file et sont scorées ensemble.
+    Chaque lot occupe une place du pool (voir ScoringPool.admission). Les requêtes sont
+    refusées (PoolSaturated) au-delà de max_queued_rows lignes en attente ou en cours de
+    scoring, par défaut de quoi remplir toutes les places du pool avec des lots complets.
+    """
+
+    def __init__(
+        self,
+        pool: ScoringPool,
+        window_ms: float = 0.0,
+        max_batch_rows: int = 1000,
+        max_queued_rows: int = None,
+    ):
+        self.pool = pool
+        self.window_ms = window_ms
+        self.max_batch_rows = max_batch_rows
+        if max_queued_rows is None:
+            max_queued_rows = max_batch_rows * (pool.workers + pool.max_queue)
+        self.max_queued_rows = max_queued_rows
+        self._queued_rows = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._carry: Optional[_PendingRequest] = None
+        self._collecting: List[_PendingRequest] = []
+        self._scoring_tasks = set()
+        self._stats = {"batches": 0, "requests": 0, "rows": 0, "max_rows": 0}
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.pool.workers)
+        self._stopping = False
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        """
+        Arrête la constitution des lots. Les lots déjà soumis au pool se terminent ; les requêtes
+        encore en attente d'un lot reçoivent PoolSaturated (503) au lieu d'attendre indéfiniment.
+        """
+        if self._task is None:
+            return
+        # asyncio.wait_for peut ignorer l'annulation si une requête arrive au même moment :
+        # le collecteur s'arrête alors de lui-même après avoir soumis le lot en cours
+        self._stopping = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._scoring_tasks:
+            await asyncio.wait(self._scoring_tasks)
+
+        pending = self._collecting + ([self._carry] if self._carry is not None else [])
+        self._collecting, self._carry = [], None
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(PoolSaturated())
+
+    async def predict(self, df: pd.DataFrame, seuil: float, **options) -> Tuple[pd.DataFrame, str]:
+        """
+        Ajoute df au prochain lot et attend ses résultats.
+
+        Retourne:
+            DataFrame des résultats de df (dans le même ordre) et version du modèle utilisée
+
+        Lève:
+            PoolSaturated si max_queued_rows lignes sont déjà en attente, si le pool n'a plus
+            de place pour le lot ou si le batcher est arrêté
+        """
+        rows = len(df)
+        if self._task is None or self._queued_rows + rows > self.max_queued_rows:
+            # Batcher arrêté (ou pas encore démarré), ou trop de lignes en attente
+            raise PoolSaturated()
+        self._queued_rows += rows
+        try:
+            key = (seuil, tuple(sorted(options.items())))
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put(_PendingRequest(key, df, future, request_timings()))
+            return await future
+        finally:
+            self._queued_rows -= rows
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Retourne la configuration et les statistiques de remplissage des lots.
+        """
+        batches = max(self._stats["batches"], 1)
+        return {
+            "window_ms": self.window_ms,
+            "max_batch_rows": self.max_batch_rows,
+            "max_queued_rows": self.max_queued_rows,
+            "queued_rows": self._queued_rows,
+            "batches": self._stats["batches"],
+            "requests": self._stats["requests"],
+            "rows": self._stats["rows"],
+            "mean_requests_per_batch": self._stats["requests"] / batches,
+            "mean_rows_per_batch": self._stats["rows"] / batches,
+            "mean_fill_ratio": self._stats["rows"] / batches / self.max_batch_rows,
+            "max_rows_per_batch": self._stats["max_rows"],
+        }
+
+    async def _next_request(self, timeout: float) -> Optional[_PendingRequest]:
+        try:
+            if timeout <= 0:
+                return self._queue.get_nowait()
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except (asyncio.QueueEmpty, asyncio.TimeoutError):
+            return None
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            # Attendre un worker libre, puis la première requête, puis ouvrir la fenêtre de regroupement
+            await self._slots.acquire()
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = await self._queue.get()
+            batch = self._collecting = [first]
+            rows = len(first.df)
+            deadline = loop.time() + self.window_ms / 1000
+
+            while rows < self.max_batch_rows and not self._stopping:
+                request = await self._next_request(deadline - loop.time())
+                if request is None:
+                    break
+                # Garder pour le lot suivant une requête qui ferait dépasser la taille maximale
+                if rows + len(request.df) > self.max_batch_rows:
+                    self._carry = request
+                    break
+                batch.append(request)
+                rows += len(request.df)
+
+            # Scorer chaque groupe d'options sans bloquer la constitution du lot suivant
+            groups: Dict[tuple, List[_PendingRequest]] = {}
+            for request in batch:
+                groups.setdefault(request.key, []).append(request)
+            for i, group in enumerate(groups.values()):
+                if i > 0:
+                    # Chaque groupe supplémentaire attend son propre worker
+                    await self._slots.acquire()
+                task = asyncio.create_task(self._score(group))
+                self._scoring_tasks.add(task)
+                task.add_done_callback(self._scoring_tasks.discard)
+            self._collecting = []
+
+    async def _score(self, group: List[_PendingRequest]) -> None:
+        seuil, options = group[0].key
+        rows = sum(len(request.df) for request in group)
+        self._stats["batches"] += 1
+        self._stats["requests"] += len(group)
+        self._stats["rows"] += rows
+        self._stats["max_rows"] = max(self._stats["max_rows"], rows)
+
+        try:
+            if len(group) == 1:
+                batch_df = group[0].df
+            else:
+                batch_df = pd.concat([request.df for request in group], ignore_index=True)
+            with self.pool.admission():
+                results_df, version, timings = await self.pool.predict(batch_df, seuil, **dict(options))
+        except Exception as e:
+            for request in group:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        # Attribuer à chaque requête du lot les durées des étapes du scoring
+        add_timings(timings, [request.timings for request in group])
+
+        # Redécouper les résultats par requête : les lignes de chaque requête sont contiguës
+        start = 0
+        for request in group:
+            end = start + len(request.df)
+            if not request.future.done():
+                request.future.set_result((results_df.iloc[start:end], version))
+            start = end
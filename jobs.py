@@ -0,0 +1,366 @@
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from metrics import CHUNK_ERRORS
+from schema import SchemaError
+from scoring_pool import ScoringPool
+from serialization import results_to_table, write_atomic
+from streaming import CHUNK_READERS, Chunk, count_rows, iter_validated_chunks
+
+logger = logging.getLogger(__name__)
+
+# Tables des tâches et de l'avancement bloc par bloc
+_TABLES = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    explain TEXT NOT NULL,
+    k INTEGER NOT NULL,
+    seuil REAL NOT NULL,
+    model_version TEXT,
+    rows_total INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    job_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    row_start INTEGER NOT NULL,
+    row_end INTEGER NOT NULL,
+    rows_scored INTEGER NOT NULL,
+    status_code INTEGER,
+    error TEXT,
+    PRIMARY KEY (job_id, chunk_index)
+);
+"""
+
+# Nombre maximal d'erreurs de blocs retournées avec l'état d'une tâche
+MAX_REPORTED_ERRORS = 100
+
+
+class JobStore:
+    """
+    Stockage local des tâches de scoring : état et avancement dans une base SQLite,
+    fichier d'entrée et résultats (un fichier Parquet par bloc) dans root/<id de la tâche>/.
+    Tout est sur disque pour que les tâches reprennent après un redémarrage de l'API.
+    """
+
+    def __init__(self, root: str):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, "jobs.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_TABLES)
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def create(self, filename: str, source, explain: str, k: int, seuil: float) -> str:
+        """
+        Enregistre une nouvelle tâche après avoir copié le fichier uploadé sur disque.
+
+        Paramètres:
+            filename: Nom du fichier uploadé (son extension détermine le lecteur)
+            source: Fichier uploadé ouvert en mode binaire
+            explain, k, seuil: Options de scoring transmises à utilities.predict
+
+        Retourne:
+            str: Identifiant de la tâche
+
+        Lève:
+            SchemaError si le fichier est vide, illisible (tronqué ou corrompu) ou s'il manque des colonnes
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.root, job_id)
+        os.makedirs(job_dir)
+        extension = os.path.splitext(filename.lower())[1]
+        input_path = os.path.join(job_dir, f"input{extension}")
+        try:
+            with open(input_path, "wb") as f:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+
+            # Rejeter tout de suite un fichier vide, incomplet ou illisible en lisant sa première ligne
+            with open(input_path, "rb") as f:
+                first_chunk = next(iter_validated_chunks(CHUNK_READERS[extension](f, 1)))
+            if first_chunk.error is not None and first_chunk.row_end == 0:
+                raise first_chunk.error
+
+            # Connaître le nombre de lignes dès la création pour suivre l'avancement de la tâche
+            rows_total = count_rows(input_path)
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        self._execute(
+            "INSERT INTO jobs (id, status, filename, input_path, explain, k, seuil, rows_total, created_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, filename, input_path, explain, k, seuil, rows_total, time.time()),
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Retourne l'état d'une tâche avec son avancement et son débit, None si elle n'existe pas.
+        """
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if len(rows) == 0:
+            return None
+        job = dict(rows[0])
+        progress = self._execute(
+            "SELECT COUNT(*) AS chunks_done, COALESCE(SUM(rows_scored), 0) AS rows_done, "
+            "COALESCE(SUM(CASE WHEN error IS NULL THEN 0 ELSE row_end - row_start END), 0) AS rows_failed "
+            "FROM chunks WHERE job_id = ?",
+            (job_id,),
+        )[0]
+        job.update(dict(progress))
+
+        # Débit depuis le début du scoring (jusqu'à la fin de la tâche si elle est terminée)
+        rows_per_second = None
+        if job["started_at"] is not None:
+            elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+            if elapsed > 0:
+                rows_per_second = (job["rows_done"] + job["rows_failed"]) / elapsed
+        job["rows_per_second"] = rows_per_second
+
+        # Part des lignes traitées (scorées ou en erreur), rows_total étant exact une fois la tâche terminée
+        progress = None
+        if job["rows_total"]:
+            progress = min((job["rows_done"] + job["rows_failed"]) / job["rows_total"], 1.0)
+        job["progress"] = progress
+
+        job["errors"] = [
+            dict(row)
+            for row in self._execute(
+                "SELECT row_start, row_end, status_code, error AS detail FROM chunks "
+                "WHERE job_id = ? AND error IS NOT NULL ORDER BY chunk_index LIMIT ?",
+                (job_id, MAX_REPORTED_ERRORS),
+            )
+        ]
+        return job
+
+    def pending_ids(self) -> List[str]:
+        """
+        Retourne les tâches en attente ou interrompues, dans leur ordre de création.
+        """
+        rows = self._execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        )
+        return [row["id"] for row in rows]
+
+    def finished_chunks(self, job_id: str) -> set:
+        """
+        Retourne les index des blocs déjà traités (scorés ou en erreur).
+        """
+        rows = self._execute("SELECT chunk_index FROM chunks WHERE job_id = ?", (job_id,))
+        return {row["chunk_index"] for row in rows}
+
+    def start(self, job_id: str, model_version: str) -> None:
+        """
+        Passe la tâche à l'état "running". Si elle avait commencé avec une autre version du
+        modèle, les blocs déjà scorés sont effacés pour que tout le fichier utilise la même version.
+        """
+        job = self.get(job_id)
+        if job["model_version"] not in (None, model_version):
+            self._execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+            job["started_at"] = None
+        self._execute(
+            "UPDATE jobs SET status = 'running', model_version = ?, started_at = ? WHERE id = ?",
+            (model_version, job["started_at"] or time.time(), job_id),
+        )
+
+    def record_chunk(
+        self,
+        job_id: str,
+        chunk_index: int,
+        chunk: Chunk,
+        results_df: Optional[pd.DataFrame] = None,
+        status_code: int = None,
+        detail: str = None,
+    ) -> None:
+        """
+        Enregistre les résultats d'un bloc (fichier Parquet) ou son erreur (code HTTP et message).
+        """
+        if status_code is not None:
+            CHUNK_ERRORS.labels(str(status_code)).inc()
+        if results_df is not None:
+            table = results_to_table(results_df)
+            write_atomic(self._part_path(job_id, chunk_index), lambda path: pq.write_table(table, path))
+        self._execute(
+            "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                chunk_index,
+                chunk.row_start,
+                chunk.row_end,
+                0 if results_df is None else len(results_df),
+                status_code,
+                detail,
+            ),
+        )
+
+    def finish(self, job_id: str, status: str, rows_total: int = None, error: str = None) -> None:
+        """
+        Passe la tâche à l'état final "done" ou "failed". rows_total, compté à la lecture complète
+        du fichier, remplace le nombre de lignes compté à la création.
+        """
+        self._execute(
+            "UPDATE jobs SET status = ?, rows_total = COALESCE(?, rows_total), error = ?, finished_at = ? "
+            "WHERE id = ?",
+            (status, rows_total, error, time.time(), job_id),
+        )
+
+    def read_results(self, job_id: str, offset: int, limit: int) -> Tuple[pd.DataFrame, int]:
+        """
+        Lit les lignes de résultats [offset, offset + limit) sans charger les autres blocs.
+
+        Les résultats disponibles sont ceux des blocs traités sans interruption depuis le début
+        du fichier : les positions ne changent donc pas pendant que la tâche avance.
+
+        Retourne:
+            Tuple[pd.DataFrame, int]: Résultats demandés (indexés par SK_ID_CURR) et nombre
+            total de lignes de résultats disponibles
+        """
+        rows = self._execute(
+            "SELECT chunk_index, rows_scored FROM chunks WHERE job_id = ? ORDER BY chunk_index",
+            (job_id,),
+        )
+
+        # Ne retenir que les fichiers de résultats qui recouvrent les lignes demandées
+        parts = []
+        available = 0
+        for expected_index, row in enumerate(rows):
+            if row["chunk_index"] != expected_index:
+                break
+            start, available = available, available + row["rows_scored"]
+            if row["rows_scored"] > 0 and start < offset + limit and available > offset:
+                parts.append((row["chunk_index"], start))
+
+        frames = []
+        for chunk_index, start in parts:
+            part_df = pq.read_table(self._part_path(job_id, chunk_index)).to_pandas().set_index("SK_ID_CURR")
+            frames.append(part_df.iloc[max(offset - start, 0) : offset + limit - start])
+        if len(frames) == 0:
+            return pd.DataFrame(), available
+        return pd.concat(frames), available
+
+    def _part_path(self, job_id: str, chunk_index: int) -> str:
+        return os.path.join(self.root, job_id, f"part-{chunk_index:06d}.parquet")
+
+
+class JobRunner:
+    """
+    Exécute les tâches une par une dans un thread de fond : le fichier est lu par blocs et
+    les blocs sont scorés en parallèle dans un pool dédié, sans concurrencer les requêtes
+    synchrones de l'API. Les tâches interrompues par un arrêt reprennent au démarrage
+    suivant à partir des blocs non encore traités.
+    """
+
+    def __init__(self, store: JobStore, pool: ScoringPool, chunk_rows: int = 5000):
+        self.store = store
+        self.pool = pool
+        self.chunk_rows = chunk_rows
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Relance les tâches en attente ou interrompues puis démarre le thread de traitement.
+        """
+        for job_id in self.store.pending_ids():
+            self._queue.put(job_id)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="scoring-jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Arrête le traitement après le bloc en cours ; la tâche reprendra au prochain démarrage.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, job_id: str) -> None:
+        self._queue.put(job_id)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job_id = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._process(job_id)
+            except SchemaError as e:
+                self.store.finish(job_id, "failed", error=e.detail)
+            except Exception as e:
+                logger.exception("Échec de la tâche de scoring %s", job_id)
+                self.store.finish(job_id, "failed", error=str(e))
+
+    def _process(self, job_id: str) -> None:
+        job = self.store.get(job_id)
+        bundle = self.pool.current()
+        self.store.start(job_id, bundle.version)
+        finished = self.store.finished_chunks(job_id)
+
+        rows_total = 0
+        in_flight = deque()
+        extension = os.path.splitext(job["input_path"])[1]
+        with open(job["input_path"], "rb") as source:
+            chunks = iter_validated_chunks(CHUNK_READERS[extension](source, self.chunk_rows))
+            for chunk_index, chunk in enumerate(chunks):
+                if self._stop.is_set():
+                    return
+                rows_total = chunk.row_end
+                if chunk_index in finished:
+                    continue
+                if chunk.error is not None:
+                    self.store.record_chunk(
+                        job_id, chunk_index, chunk, status_code=chunk.error.status_code, detail=chunk.error.detail
+                    )
+                    continue
+
+                future, _ = self.pool.submit(
+                    chunk.df, job["seuil"], bundle, explain=job["explain"], k=job["k"]
+                )
+                in_flight.append((chunk_index, chunk, future))
+                # Limiter le nombre de blocs en mémoire au nombre de workers du pool
+                if len(in_flight) >= self.pool.workers:
+                    self._collect(job_id, *in_flight.popleft())
+
+            while len(in_flight) > 0:
+                self._collect(job_id, *in_flight.popleft())
+
+        self.store.finish(job_id, "done", rows_total=rows_total)
+
+    def _collect(self, job_id: str, chunk_index: int, chunk: Chunk, future) -> None:
+        try:
+            results_df, _, _ = future.result()
+        except Exception as e:
+            self.store.record_chunk(
+                job_id, chunk_index, chunk, status_code=500, detail=f"Erreur lors du scoring: {e}"
+            )
+        else:
+            self.store.record_chunk(job_id, chunk_index, chunk, results_df=results_df)
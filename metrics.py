@@ -0,0 +1,176 @@
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+
+# Durée de chaque étape, de la réception du fichier à l'encodage de la réponse
+STAGE_SECONDS = Histogram(
+    "defaut_credit_stage_seconds",
+    "Durée des étapes du traitement des requêtes (upload, lecture, validation, modèle, SHAP, encodage)",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_SECONDS = Histogram(
+    "defaut_credit_request_seconds",
+    "Durée totale des requêtes par endpoint",
+    ["endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RESPONSES = Counter(
+    "defaut_credit_responses",
+    "Réponses par endpoint et code HTTP",
+    ["endpoint", "status_code"],
+)
+BATCH_ROWS = Histogram(
+    "defaut_credit_batch_rows",
+    "Nombre de lignes par lot soumis au pool de scoring",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000),
+)
+ROWS_SCORED = Counter(
+    "defaut_credit_rows_scored",
+    "Nombre de lignes scorées par mode d'explication",
+    ["explain"],
+)
+CHUNK_ERRORS = Counter(
+    "defaut_credit_chunk_errors",
+    "Blocs en erreur des scorings en flux et des tâches, par code HTTP",
+    ["status_code"],
+)
+PEAK_MEMORY_BYTES = Histogram(
+    "defaut_credit_batch_peak_memory_bytes",
+    "Pic de mémoire allouée par Python et numpy pendant le scoring d'un lot (avec MEMORY_PROFILE=1)",
+    ["explain"],
+    buckets=tuple(megabytes * 2**20 for megabytes in (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)),
+)
+CHALLENGER_BATCHES = Counter(
+    "defaut_credit_challenger_batches",
+    "Lots comparés aux versions challengers, par issue (scored, dropped si la file est pleine, failed)",
+    ["outcome"],
+)
+
+# Suivre les allocations avec tracemalloc pour mesurer le pic de mémoire de chaque lot. Ralentit le
+# scoring : à activer pour dimensionner le nombre de workers. Les processus de scoring héritent de la
+# variable d'environnement et importent ce module, ils sont donc suivis eux aussi
+if os.environ.get("MEMORY_PROFILE", "0").lower() in ("1", "true", "yes"):
+    tracemalloc.start()
+
+# Début et durées des étapes de la requête en cours (None hors requête)
+_request: ContextVar[Optional[Tuple[float, Dict[str, float]]]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def start_request() -> Dict[str, float]:
+    """
+    Démarre le suivi des étapes de la requête en cours et retourne le dictionnaire de leurs durées.
+    Le dictionnaire est partagé avec les threads lancés par run_in_threadpool, qui copient le contexte.
+    """
+    timings: Dict[str, float] = {}
+    _request.set((time.perf_counter(), timings))
+    return timings
+
+
+def request_timings() -> Optional[Dict[str, float]]:
+    """
+    Retourne les durées des étapes de la requête en cours, None hors requête.
+    """
+    state = _request.get()
+    return None if state is None else state[1]
+
+
+def elapsed_since_request_start() -> float:
+    """
+    Retourne le temps écoulé depuis le début de la requête en cours (0 hors requête).
+    """
+    state = _request.get()
+    return 0.0 if state is None else time.perf_counter() - state[0]
+
+
+@contextmanager
+def span(timings: Optional[Dict[str, float]], stage: str):
+    """
+    Ajoute la durée du bloc à timings[stage] (rien si timings vaut None), sans l'exporter.
+    Utilisée dans le code exécuté par les workers, dont les durées sont exportées par le processus principal.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Mesure la durée du bloc, l'exporte dans l'histogramme des étapes et l'ajoute aux durées
+    de la requête en cours.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stages({stage: time.perf_counter() - start}, [request_timings()])
+
+
+@contextmanager
+def peak_memory():
+    """
+    Mesure le pic de mémoire allouée pendant le bloc, au-delà de la mémoire déjà allouée à son début.
+    Retourne (avec as) un dictionnaire dont la clé peak_bytes est renseignée à la sortie du bloc,
+    None si MEMORY_PROFILE n'est pas activé. Le pic est celui du processus : avec un pool de threads,
+    les lots scorés en même temps s'ajoutent les uns aux autres.
+    """
+    usage = {"peak_bytes": None}
+    if not tracemalloc.is_tracing():
+        yield usage
+        return
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield usage
+    finally:
+        usage["peak_bytes"] = max(tracemalloc.get_traced_memory()[1] - start, 0)
+
+
+def record_stages(
+    timings: Dict[str, float], targets: Iterable[Optional[Dict[str, float]]] = ()
+) -> None:
+    """
+    Exporte des durées d'étapes dans l'histogramme et les ajoute aux durées des requêtes targets.
+    Les targets valant None (hors requête) sont ignorées.
+    """
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+    add_timings(timings, targets)
+
+
+def add_timings(timings: Dict[str, float], targets: Iterable[Optional[Dict[str, float]]]) -> None:
+    """
+    Ajoute des durées d'étapes aux durées des requêtes targets sans les exporter.
+    """
+    for target in targets:
+        if target is not None:
+            for stage, seconds in timings.items():
+                target[stage] = target.get(stage, 0.0) + seconds
+
+
+def record_response(endpoint: str, status_code: int, seconds: float) -> None:
+    """
+    Exporte la durée et le code HTTP d'une réponse.
+    """
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    RESPONSES.labels(endpoint, str(status_code)).inc()
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    """
+    Construit l'en-tête Server-Timing (durées en millisecondes) à partir des durées des étapes.
+    """
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
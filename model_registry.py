@@ -0,0 +1,239 @@
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from scipy import sparse
+from sklearn.pipeline import Pipeline
+
+from metrics import timed
+from schema import SCHEMA
+from utilities import (
+    RecordPreprocessor,
+    get_feature_names_from_column_transformer,
+    create_feature_mapping,
+    build_aggregation_matrix,
+)
+
+logger = logging.getLogger(__name__)
+
+# Nom du modèle enregistré dans le registre MLflow
+MODEL_NAME = "Defaut_Credit_LGBM_Pipeline_VF"
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """
+    Regroupe tout ce qui est nécessaire pour scorer avec une version du modèle.
+    Construit une seule fois par version puis partagé (en lecture seule) entre les requêtes.
+    """
+
+    version: str
+    pipe: Pipeline
+    preprocessor: Pipeline
+    model: Any
+    explainer: Any
+    original_features: List[str]
+    transformed_features: List[str]
+    feature_mapping: Dict[str, List[int]]
+    grouped_features: List[str]
+    aggregation_matrix: sparse.csr_matrix
+    # Empreinte du prétraitement ajusté : deux versions de même empreinte partagent la matrice transformée
+    preprocessing_key: str
+    # Prétraitement précalculé du chemin à faible latence (utilities.predict_records)
+    record_preprocessor: RecordPreprocessor
+
+
+def feature_metadata(pipe: Pipeline) -> Dict[str, Any]:
+    """
+    Calcule les métadonnées des variables d'un pipeline : variables originales et transformées,
+    mapping entre les deux et matrice d'agrégation des valeurs SHAP.
+
+    Paramètres:
+        pipe: Pipeline contenant le ColumnTransformer et le modèle LightGBM
+
+    Retourne:
+        Dict: Champs original_features, transformed_features, feature_mapping, grouped_features
+        et aggregation_matrix du ModelBundle
+    """
+    # Récupérer les variables originales vues par le ColumnTransformer lors de l'entraînement
+    ct = pipe["columntransformer"]
+    original_features = list(ct.feature_names_in_)
+
+    # Récupérer le nom des variables transformées et le mapping avec les variables originales
+    transformed_features = get_feature_names_from_column_transformer(ct, original_features)
+    feature_mapping = create_feature_mapping(original_features, transformed_features)
+    grouped_features, aggregation_matrix = build_aggregation_matrix(
+        feature_mapping, original_features, len(transformed_features)
+    )
+
+    return {
+        "original_features": original_features,
+        "transformed_features": transformed_features,
+        "feature_mapping": feature_mapping,
+        "grouped_features": grouped_features,
+        "aggregation_matrix": aggregation_matrix,
+    }
+
+
+def preprocessing_fingerprint(pipe: Pipeline) -> str:
+    """
+    Retourne l'empreinte du prétraitement ajusté d'un pipeline (toutes les étapes sauf le modèle).
+    """
+    import joblib
+
+    return joblib.hash(pipe[:-1])
+
+
+def build_bundle(
+    pipe: Pipeline, version: str, metadata: Dict[str, Any] = None, preprocessing_key: str = None
+) -> ModelBundle:
+    """
+    Construit l'explainer SHAP et les métadonnées des variables pour un pipeline déjà chargé.
+
+    Paramètres:
+        pipe: Pipeline contenant le ColumnTransformer et le modèle LightGBM
+        version: Version du modèle dans le registre MLflow
+        metadata: Métadonnées des variables déjà calculées par feature_metadata (optionnel)
+        preprocessing_key: Empreinte déjà calculée par preprocessing_fingerprint (optionnel)
+
+    Retourne:
+        ModelBundle prêt à être utilisé par utilities.predict
+    """
+    # shap n'est importé qu'au chargement du modèle pour que l'API démarre sans l'attendre
+    import shap
+
+    if metadata is None:
+        metadata = feature_metadata(pipe)
+    if preprocessing_key is None:
+        preprocessing_key = preprocessing_fingerprint(pipe)
+
+    # Créer l'explainer avec le modèle
+    model = pipe.named_steps["lgbmclassifier"]
+    explainer = shap.TreeExplainer(model)
+
+    return ModelBundle(
+        version=str(version),
+        pipe=pipe,
+        preprocessor=pipe[:-1],
+        model=model,
+        explainer=explainer,
+        preprocessing_key=preprocessing_key,
+        record_preprocessor=RecordPreprocessor(pipe[:-1], SCHEMA.object_columns),
+        **metadata,
+    )
+
+
+def resolve_latest_version(model_name: str = MODEL_NAME) -> str:
+    """
+    Retourne le numéro de la dernière version enregistrée du modèle dans MLflow.
+    """
+    from mlflow.tracking import MlflowClient
+
+    versions = MlflowClient().search_model_versions(f"name='{model_name}'")
+    if len(versions) == 0:
+        raise LookupError(f"Aucune version enregistrée pour le modèle {model_name}")
+    return str(max(int(v.version) for v in versions))
+
+
+def load_bundle(version: str, model_name: str = MODEL_NAME) -> ModelBundle:
+    """
+    Charge une version précise du pipeline depuis MLflow et construit son ModelBundle.
+    """
+    import mlflow.sklearn
+
+    pipe = mlflow.sklearn.load_model(f"models:/{model_name}/{version}")
+    return build_bundle(pipe, version)
+
+
+class ModelRegistry:
+    """
+    Garde en mémoire le modèle servi et surveille le registre MLflow.
+
+    Lorsqu'une nouvelle version "latest" apparaît, elle est chargée en arrière-plan
+    puis substituée de façon atomique : les requêtes en cours terminent avec
+    l'ancienne version, les suivantes utilisent la nouvelle.
+    """
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        poll_interval: float = 60.0,
+        loader: Callable[[str, str], ModelBundle] = load_bundle,
+        resolver: Callable[[str], str] = resolve_latest_version,
+    ):
+        self.model_name = model_name
+        self.poll_interval = poll_interval
+        self.loader = loader
+        self._resolver = resolver
+        self._bundle: Optional[ModelBundle] = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[ModelBundle], None]] = []
+
+    def add_listener(self, callback: Callable[[ModelBundle], None]) -> None:
+        """
+        Enregistre une fonction appelée avec le nouveau bundle après chaque changement de version.
+        """
+        self._listeners.append(callback)
+
+    def start(self) -> None:
+        """
+        Charge la dernière version du modèle puis lance la surveillance du registre.
+        """
+        self.refresh()
+        if self.poll_interval > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._poll, name="model-registry-poll", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Arrête la surveillance du registre.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def current(self) -> ModelBundle:
+        """
+        Retourne le modèle actuellement servi. La référence retournée reste valide
+        pendant toute la requête, même si une nouvelle version est chargée entre-temps.
+        """
+        bundle = self._bundle
+        if bundle is None:
+            raise RuntimeError("Aucun modèle n'est chargé")
+        return bundle
+
+    def refresh(self) -> bool:
+        """
+        Charge la dernière version du registre si elle diffère de la version servie.
+
+        Retourne:
+            True si une nouvelle version a été chargée
+        """
+        with self._reload_lock:
+            latest = self._resolver(self.model_name)
+            if self._bundle is not None and self._bundle.version == latest:
+                return False
+
+            # Construire le nouveau bundle avant de le substituer à l'ancien
+            with timed("model_load"):
+                bundle = self.loader(latest, self.model_name)
+            self._bundle = bundle
+            logger.info("Modèle %s version %s chargé", self.model_name, bundle.version)
+
+            for callback in self._listeners:
+                callback(bundle)
+            return True
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Échec de la vérification du registre MLflow")
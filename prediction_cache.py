@@ -0,0 +1,133 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class PredictionCache:
+    """
+    Cache LRU avec durée de vie des résultats de scoring, indexé par le contenu des lignes.
+
+    La clé d'une ligne est un hash de ses valeurs normalisées (après conversion aux types
+    du schéma, SK_ID_CURR exclu) associé à un périmètre : version du modèle, seuil et
+    options d'explication. Le cache est borné en nombre d'entrées et en mémoire estimée.
+    Chaque entrée garde les noms de ses colonnes, qui disparaissent donc avec elle.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 100_000,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 600.0,
+        id_column: str = "SK_ID_CURR",
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.id_column = id_column
+        self._entries: "OrderedDict[tuple, Tuple[float, tuple, int, tuple]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def row_hashes(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Calcule le hash de chaque ligne normalisée, de façon vectorisée.
+        """
+        return pd.util.hash_pandas_object(
+            df.drop(columns=self.id_column), index=False
+        ).to_numpy()
+
+    def get_many(self, scope: Hashable, hashes: np.ndarray) -> List[Optional[Tuple[tuple, tuple]]]:
+        """
+        Retourne pour chaque hash les noms des colonnes et la ligne de résultats en cache,
+        ou None si absente ou expirée. Les lignes retournées restent utilisables même si le
+        cache est vidé entre-temps (nouvelle version du modèle).
+        """
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for row_hash in hashes.tolist():
+                key = (scope, row_hash)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < now:
+                    self._remove(key)
+                    self._counters["expirations"] += 1
+                    entry = None
+                if entry is None:
+                    self._counters["misses"] += 1
+                    rows.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    rows.append((entry[3], entry[1]))
+        return rows
+
+    def put_many(self, scope: Hashable, hashes: np.ndarray, results_df: pd.DataFrame) -> None:
+        """
+        Met en cache les lignes de results_df (dans le même ordre que hashes).
+        """
+        if len(results_df) == 0:
+            return
+        rows = list(results_df.itertuples(index=False, name=None))
+
+        # Estimer la taille d'une ligne une seule fois : toutes les lignes ont le même schéma
+        row_size = sys.getsizeof(rows[0]) + sum(sys.getsizeof(value) for value in rows[0])
+        # Noms des colonnes partagés par toutes les lignes du lot
+        columns = tuple(results_df.columns)
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for row_hash, row in zip(hashes.tolist(), rows):
+                key = (scope, row_hash)
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = (expires_at, row, row_size, columns)
+                self._bytes += row_size
+
+            # Évincer les entrées les moins récemment utilisées au-delà des limites
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                key = next(iter(self._entries))
+                self._remove(key)
+                self._counters["evictions"] += 1
+
+    def build_frame(self, rows: List[Tuple[tuple, tuple]], index: pd.Index) -> pd.DataFrame:
+        """
+        Reconstruit un DataFrame de résultats à partir de lignes retournées par get_many
+        pour un même périmètre (donc avec les mêmes colonnes).
+        """
+        return pd.DataFrame.from_records([row for _, row in rows], columns=list(rows[0][0]), index=index)
+
+    def clear(self, *args) -> None:
+        """
+        Vide le cache (appelée notamment lors du chargement d'une nouvelle version du modèle).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "estimated_bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                **self._counters,
+                "hit_ratio": self._counters["hits"] / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
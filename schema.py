@@ -0,0 +1,333 @@
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel, ConfigDict, create_model
+
+# Colonnes attendues par le modèle et leur type
+NEEDED_COLUMNS = {
+    'SK_ID_CURR': 'int64', 'NAME_CONTRACT_TYPE': 'object', 'CODE_GENDER': 'object', 'FLAG_OWN_CAR': 'object', 'FLAG_OWN_REALTY': 'object',
+    'CNT_CHILDREN': 'int64', 'AMT_INCOME_TOTAL': 'float64', 'AMT_CREDIT': 'float64', 'AMT_ANNUITY': 'float64', 'AMT_GOODS_PRICE': 'float64',
+    'NAME_TYPE_SUITE': 'object', 'NAME_INCOME_TYPE': 'object', 'NAME_EDUCATION_TYPE': 'object', 'NAME_FAMILY_STATUS': 'object', 'NAME_HOUSING_TYPE': 'object',
+    'REGION_POPULATION_RELATIVE': 'float64', 'DAYS_BIRTH': 'int64', 'DAYS_EMPLOYED': 'int64', 'DAYS_REGISTRATION': 'float64', 'DAYS_ID_PUBLISH': 'int64',
+    'OWN_CAR_AGE': 'float64', 'FLAG_MOBIL': 'int64', 'FLAG_EMP_PHONE': 'int64', 'FLAG_WORK_PHONE': 'int64', 'FLAG_CONT_MOBILE': 'int64',
+    'FLAG_PHONE': 'int64', 'FLAG_EMAIL': 'int64', 'OCCUPATION_TYPE': 'object', 'CNT_FAM_MEMBERS': 'float64', 'REGION_RATING_CLIENT': 'int64',
+    'REGION_RATING_CLIENT_W_CITY': 'int64', 'WEEKDAY_APPR_PROCESS_START': 'object', 'HOUR_APPR_PROCESS_START': 'int64', 'REG_REGION_NOT_LIVE_REGION': 'int64', 'REG_REGION_NOT_WORK_REGION': 'int64',
+    'LIVE_REGION_NOT_WORK_REGION': 'int64', 'REG_CITY_NOT_LIVE_CITY': 'int64', 'REG_CITY_NOT_WORK_CITY': 'int64', 'LIVE_CITY_NOT_WORK_CITY': 'int64', 'ORGANIZATION_TYPE': 'object',
+    'EXT_SOURCE_1': 'float64', 'EXT_SOURCE_2': 'float64', 'EXT_SOURCE_3': 'float64', 'APARTMENTS_AVG': 'float64', 'BASEMENTAREA_AVG': 'float64',
+    'YEARS_BEGINEXPLUATATION_AVG': 'float64', 'YEARS_BUILD_AVG': 'float64', 'COMMONAREA_AVG': 'float64', 'ELEVATORS_AVG': 'float64', 'ENTRANCES_AVG': 'float64',
+    'FLOORSMAX_AVG': 'float64', 'FLOORSMIN_AVG': 'float64', 'LANDAREA_AVG': 'float64', 'LIVINGAPARTMENTS_AVG': 'float64', 'LIVINGAREA_AVG': 'float64',
+    'NONLIVINGAPARTMENTS_AVG': 'float64', 'NONLIVINGAREA_AVG': 'float64', 'APARTMENTS_MODE': 'float64', 'BASEMENTAREA_MODE': 'float64', 'YEARS_BEGINEXPLUATATION_MODE': 'float64',
+    'YEARS_BUILD_MODE': 'float64', 'COMMONAREA_MODE': 'float64', 'ELEVATORS_MODE': 'float64', 'ENTRANCES_MODE': 'float64', 'FLOORSMAX_MODE': 'float64',
+    'FLOORSMIN_MODE': 'float64', 'LANDAREA_MODE': 'float64', 'LIVINGAPARTMENTS_MODE': 'float64', 'LIVINGAREA_MODE': 'float64', 'NONLIVINGAPARTMENTS_MODE': 'float64',
+    'NONLIVINGAREA_MODE': 'float64', 'APARTMENTS_MEDI': 'float64', 'BASEMENTAREA_MEDI': 'float64', 'YEARS_BEGINEXPLUATATION_MEDI': 'float64', 'YEARS_BUILD_MEDI': 'float64',
+    'COMMONAREA_MEDI': 'float64', 'ELEVATORS_MEDI': 'float64', 'ENTRANCES_MEDI': 'float64', 'FLOORSMAX_MEDI': 'float64', 'FLOORSMIN_MEDI': 'float64',
+    'LANDAREA_MEDI': 'float64', 'LIVINGAPARTMENTS_MEDI': 'float64', 'LIVINGAREA_MEDI': 'float64', 'NONLIVINGAPARTMENTS_MEDI': 'float64', 'NONLIVINGAREA_MEDI': 'float64',
+    'FONDKAPREMONT_MODE': 'float64', 'HOUSETYPE_MODE': 'object', 'TOTALAREA_MODE': 'float64', 'WALLSMATERIAL_MODE': 'object', 'EMERGENCYSTATE_MODE': 'object',
+    'OBS_30_CNT_SOCIAL_CIRCLE': 'float64', 'DEF_30_CNT_SOCIAL_CIRCLE': 'float64', 'OBS_60_CNT_SOCIAL_CIRCLE': 'float64', 'DEF_60_CNT_SOCIAL_CIRCLE': 'float64', 'DAYS_LAST_PHONE_CHANGE': 'float64',
+    'FLAG_DOCUMENT_2': 'int64', 'FLAG_DOCUMENT_3': 'int64', 'FLAG_DOCUMENT_4': 'int64', 'FLAG_DOCUMENT_5': 'int64', 'FLAG_DOCUMENT_6': 'int64',
+    'FLAG_DOCUMENT_7': 'int64', 'FLAG_DOCUMENT_8': 'int64', 'FLAG_DOCUMENT_9': 'int64', 'FLAG_DOCUMENT_10': 'int64', 'FLAG_DOCUMENT_11': 'int64',
+    'FLAG_DOCUMENT_12': 'int64', 'FLAG_DOCUMENT_13': 'int64', 'FLAG_DOCUMENT_14': 'int64', 'FLAG_DOCUMENT_15': 'int64', 'FLAG_DOCUMENT_16': 'int64',
+    'FLAG_DOCUMENT_17': 'int64', 'FLAG_DOCUMENT_18': 'int64', 'FLAG_DOCUMENT_19': 'int64', 'FLAG_DOCUMENT_20': 'int64', 'FLAG_DOCUMENT_21': 'int64',
+    'AMT_REQ_CREDIT_BUREAU_HOUR': 'float64', 'AMT_REQ_CREDIT_BUREAU_DAY': 'float64', 'AMT_REQ_CREDIT_BUREAU_WEEK': 'float64', 'AMT_REQ_CREDIT_BUREAU_MON': 'float64', 'AMT_REQ_CREDIT_BUREAU_QRT': 'float64',
+    'AMT_REQ_CREDIT_BUREAU_YEAR': 'float64'
+}
+
+class SchemaError(ValueError):
+    """
+    Levée lorsque les données clients ne respectent pas le schéma attendu.
+    status_code correspond au code HTTP à retourner par l'API.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class CompiledSchema:
+    """
+    Schéma des données clients compilé une seule fois à partir de NEEDED_COLUMNS.
+
+    Sert à lire les fichiers en ne parsant que les colonnes utiles et à valider
+    les données (colonnes manquantes, identifiants vides, types) en une seule passe.
+    """
+
+    def __init__(self, needed_columns: Dict[str, str], id_column: str = "SK_ID_CURR"):
+        self.dtypes = dict(needed_columns)
+        self.columns: List[str] = list(needed_columns)
+        self.id_column = id_column
+        self.int_columns = [col for col, dtype in needed_columns.items() if dtype == "int64"]
+        self.float_columns = [col for col, dtype in needed_columns.items() if dtype == "float64"]
+        self.numeric_columns = [col for col, dtype in needed_columns.items() if dtype != "object"]
+        self.object_columns = [col for col, dtype in needed_columns.items() if dtype == "object"]
+        # Types imposés à la lecture des CSV : les colonnes texte n'ont ainsi plus à être converties.
+        # Les colonnes numériques restent inférées pour pouvoir signaler toutes les valeurs invalides.
+        self.csv_dtypes = {col: object for col in self.object_columns}
+
+    def read_csv(self, source) -> pd.DataFrame:
+        """
+        Lit un fichier CSV avec le parseur C en ne parsant que les colonnes du schéma,
+        les colonnes texte étant lues directement en object.
+
+        Paramètre: source: Fichier CSV ouvert en mode binaire (positionné au début)
+        Retourne: pd.DataFrame: Colonnes du schéma présentes dans le fichier, types numériques inférés
+        Lève: SchemaError (400) si le fichier n'est pas un CSV lisible
+        """
+        try:
+            df = pd.read_csv(source, usecols=self.is_schema_column, dtype=self.csv_dtypes)
+            if df.shape[1] == 0:
+                # Aucune colonne utile : le fichier sera rejeté, seule la lecture des lignes importe
+                source.seek(0)
+                df = pd.read_csv(source)
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+        except (pd.errors.ParserError, UnicodeDecodeError) as e:
+            raise self._read_error(e)
+        return df
+
+    def iter_csv(self, source, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """
+        Lit un fichier CSV par blocs de chunk_rows lignes en ne gardant que les colonnes du schéma.
+        Seul le bloc courant est en mémoire, quelle que soit la taille du fichier.
+
+        Paramètres:
+            source: Fichier CSV ouvert en mode binaire (positionné au début)
+            chunk_rows: Nombre de lignes par bloc
+        Retourne: Iterator[pd.DataFrame]: Blocs non vides, types numériques inférés bloc par bloc
+        """
+        try:
+            chunks = pd.read_csv(
+                source, usecols=self.is_schema_column, dtype=self.csv_dtypes, chunksize=chunk_rows
+            )
+        except pd.errors.EmptyDataError:
+            return
+        for chunk in chunks:
+            if chunk.shape[1] == 0:
+                # Aucune colonne utile : relire toutes les colonnes pour que chaque bloc soit rejeté
+                source.seek(0)
+                yield from (chunk for chunk in pd.read_csv(source, chunksize=chunk_rows) if len(chunk) > 0)
+                return
+            if len(chunk) > 0:
+                yield chunk
+
+    def is_schema_column(self, column: str) -> bool:
+        """
+        Indique si une colonne fait partie du schéma (usecols des lectures CSV, sans lire l'entête à part).
+        """
+        return column in self.dtypes
+
+    def read_parquet(self, source) -> pd.DataFrame:
+        """
+        Lit un fichier Parquet en ne chargeant que les colonnes du schéma.
+
+        Paramètre: source: Fichier Parquet ouvert en mode binaire
+        Retourne: pd.DataFrame: Colonnes du schéma présentes dans le fichier
+        Lève: SchemaError (400) si le fichier est tronqué ou n'est pas un fichier Parquet
+        """
+        try:
+            parquet_file = pq.ParquetFile(source)
+            usecols = [col for col in self.columns if col in parquet_file.schema_arrow.names]
+            table = parquet_file.read(columns=usecols)
+        except (pa.ArrowInvalid, OSError) as e:
+            raise self._read_error(e)
+        return self._table_to_pandas(table)
+
+    def iter_parquet(self, source, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """
+        Lit un fichier Parquet par blocs de chunk_rows lignes en ne chargeant que les colonnes du schéma.
+
+        Paramètres:
+            source: Fichier Parquet ouvert en mode binaire
+            chunk_rows: Nombre de lignes par bloc
+        Retourne: Iterator[pd.DataFrame]: Blocs non vides
+        """
+        parquet_file = pq.ParquetFile(source)
+        usecols = [col for col in self.columns if col in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=usecols):
+            if batch.num_rows > 0:
+                yield self._table_to_pandas(pa.Table.from_batches([batch]))
+
+    def read_arrow(self, source) -> pd.DataFrame:
+        """
+        Lit un fichier Arrow IPC (format fichier ou flux) en ne gardant que les colonnes du schéma.
+
+        Paramètre: source: Fichier Arrow ouvert en mode binaire
+        Retourne: pd.DataFrame: Colonnes du schéma présentes dans le fichier
+        Lève: SchemaError (400) si le fichier est tronqué ou n'est ni un fichier ni un flux Arrow IPC
+        """
+        # Lire les octets une seule fois : les colonnes Arrow pointent directement dans ce buffer
+        buffer = pa.py_buffer(source.read())
+        try:
+            try:
+                table = pa.ipc.open_file(buffer).read_all()
+            except pa.ArrowInvalid:
+                table = pa.ipc.open_stream(buffer).read_all()
+        except (pa.ArrowInvalid, OSError) as e:
+            raise self._read_error(e)
+        usecols = [col for col in self.columns if col in table.column_names]
+        return self._table_to_pandas(table.select(usecols))
+
+    def _table_to_pandas(self, table: pa.Table) -> pd.DataFrame:
+        # Garder un bloc par colonne pour éviter la copie de consolidation de pandas
+        with_nulls = [
+            col for col in self.object_columns if col in table.column_names and table.column(col).null_count > 0
+        ]
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+        # Uniformiser les valeurs manquantes des colonnes texte (None renvoyé par pyarrow) en NaN
+        for col in with_nulls:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+        return df
+
+    def build_record_model(self, name: str) -> type:
+        """
+        Construit le modèle pydantic d'un client à partir du schéma : les colonnes entières
+        sont obligatoires, les colonnes décimales et texte acceptent null ou une absence.
+        Les types sont stricts, comme pour les fichiers : un booléen ou un nombre entre guillemets
+        est refusé (422) au lieu d'être converti, un entier reste accepté pour une colonne décimale.
+        """
+        fields = {}
+        for col, dtype in self.dtypes.items():
+            if dtype == "int64":
+                fields[col] = (int, ...)
+            elif dtype == "float64":
+                fields[col] = (Optional[float], None)
+            else:
+                fields[col] = (Optional[str], None)
+        return create_model(name, __config__=ConfigDict(strict=True), **fields)
+
+    def frame_from_records(self, records: List[dict]) -> pd.DataFrame:
+        """
+        Construit le DataFrame de clients déjà validés (par build_record_model) sans passer par
+        l'inférence de types de pandas : les valeurs sont écrites directement dans un bloc numpy
+        préalloué par type.
+
+        Paramètre: records: Liste de dictionnaires {colonne: valeur}
+        Retourne: pd.DataFrame: Une ligne par client, aux types du schéma
+        """
+        n = len(records)
+        float_block = np.empty((n, len(self.float_columns)), dtype=np.float64)
+        int_block = np.empty((n, len(self.int_columns)), dtype=np.int64)
+        object_block = np.empty((n, len(self.object_columns)), dtype=object)
+        for i, record in enumerate(records):
+            float_block[i] = [np.nan if record.get(col) is None else record[col] for col in self.float_columns]
+            int_block[i] = [record[col] for col in self.int_columns]
+            object_block[i] = [np.nan if record.get(col) is None else record[col] for col in self.object_columns]
+
+        return pd.concat(
+            [
+                pd.DataFrame(float_block, columns=self.float_columns, copy=False),
+                pd.DataFrame(int_block, columns=self.int_columns, copy=False),
+                pd.DataFrame(object_block, columns=self.object_columns, copy=False),
+            ],
+            axis=1,
+            copy=False,
+        )
+
+    def validate(self, df: pd.DataFrame, max_rows: Optional[int] = None) -> pd.DataFrame:
+        """
+        Vérifie les données clients et les convertit aux types attendus par le modèle.
+
+        Paramètres:
+            df: Données clients lues par read_csv (ou tout DataFrame)
+            max_rows: Nombre maximal de lignes autorisé (optionnel)
+
+        Retourne:
+            pd.DataFrame: Colonnes du schéma, dans l'ordre du schéma et aux types attendus
+
+        Lève:
+            SchemaError avec le code HTTP et le message à retourner
+        """
+        # Vérifier que le fichier n'est pas vide
+        if df.shape[0] == 0:
+            raise SchemaError(
+                400, "Le fichier CSV est vide. Veuillez fournir un fichier contenant des données."
+            )
+
+        # Vérifier que le fichier n'est pas trop volumineux
+        if max_rows is not None and df.shape[0] > max_rows:
+            max_rows_str = f"{max_rows:,}".replace(",", " ")
+            raise SchemaError(
+                413,
+                f"Le fichier est trop volumineux ({df.shape[0]} lignes). Maximum autorisé: {max_rows_str} lignes.",
+            )
+
+        # Vérifier que le fichier contient toutes les colonnes nécessaires
+        self.check_columns(df.columns)
+
+        # Vérifier que le fichier contient au moins l'ID
+        nb_id_manquants = int(df[self.id_column].isna().sum())
+        if nb_id_manquants > 0:
+            raise SchemaError(
+                400,
+                f"Le fichier contient {nb_id_manquants} ligne(s) avec des valeurs manquantes dans la colonne {self.id_column}. Toutes les lignes doivent avoir un identifiant client.",
+            )
+
+        # Vérifier les types des colonnes en une passe : les colonnes numériques doivent avoir été
+        # lues comme des nombres et les colonnes entières ne pas contenir de valeurs manquantes
+        current_dtypes = df.dtypes
+        int_with_na = df[self.int_columns].isna().any()
+        int_with_na = set(int_with_na.index[int_with_na])
+        failed_columns = [
+            col
+            for col in self.numeric_columns
+            if current_dtypes[col].kind not in "biuf" or col in int_with_na
+        ]
+        if len(failed_columns) > 0:
+            raise self._dtype_error(failed_columns, current_dtypes)
+
+        # Ne convertir que les colonnes dont le type lu diffère du schéma (décimaux lus comme entiers
+        # par exemple) : les colonnes texte lues par read_csv sont déjà en object
+        to_convert = {
+            col: self.dtypes[col] for col in self.columns if current_dtypes[col] != self.dtypes[col]
+        }
+        if list(df.columns) != self.columns:
+            df = df[self.columns]
+        if len(to_convert) == 0:
+            return df
+
+        # Remplacer les colonnes converties une par une sur une copie superficielle : convertir
+        # tout le DataFrame avec astype reconstruirait chaque colonne
+        df = df.copy(deep=False)
+        failed_columns = []
+        for col, dtype in to_convert.items():
+            try:
+                df[col] = df[col].astype(dtype)
+            except (ValueError, TypeError):
+                # Valeurs non convertibles malgré un type numérique (valeurs infinies par exemple)
+                failed_columns.append(col)
+        if len(failed_columns) > 0:
+            raise self._dtype_error(failed_columns, current_dtypes)
+        return df
+
+    def check_columns(self, columns) -> None:
+        """
+        Vérifie que toutes les colonnes du schéma sont présentes.
+        Lève SchemaError (400) avec la liste des colonnes manquantes.
+        """
+        col_manquantes = [col for col in self.columns if col not in columns]
+        if len(col_manquantes) > 0:
+            raise SchemaError(
+                400,
+                f"Le fichier ne contient pas toutes les colonnes nécessaires. Colonnes manquantes: {col_manquantes}",
+            )
+
+    def _read_error(self, error: Exception) -> SchemaError:
+        # Fichier illisible (tronqué, corrompu ou d'un autre format) : erreur du client, pas du serveur
+        return SchemaError(400, f"Lecture du fichier impossible: {error}")
+
+    def _dtype_error(self, failed_columns: List[str], current_dtypes: pd.Series) -> SchemaError:
+        error_msg = "Impossible de convertir les types de données pour les colonnes: "
+        error_msg += ", ".join(
+            [
+                f"{col} (attendu: {self.dtypes[col]}, trouvé: {current_dtypes[col]})"
+                for col in failed_columns
+            ]
+        )
+        return SchemaError(400, error_msg)
+
+
+# Schéma compilé une seule fois au chargement du module
+SCHEMA = CompiledSchema(NEEDED_COLUMNS)
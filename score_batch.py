@@ -0,0 +1,313 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from metrics import peak_memory
+from model_registry import MODEL_NAME, ModelBundle, load_bundle, resolve_latest_version
+from schema import SchemaError
+from scoring_pool import _init_worker, _worker_bundle
+from serialization import results_to_table, write_atomic
+from snapshot import load_snapshot, snapshot_version
+from streaming import CHUNK_READERS, iter_validated_chunks
+from utilities import EXPLAIN_MODES, SEUIL_DEFAUT, parse_product_thresholds, predict
+
+
+def _score_shard(
+    df: pd.DataFrame,
+    shard_path: str,
+    loader: Callable[[str, str], ModelBundle],
+    model_name: str,
+    version: str,
+    explain: str,
+    k: int,
+    output_format: str,
+    lean: bool,
+    product_thresholds: Tuple[Tuple[str, float], ...],
+) -> Tuple[int, float, Optional[int]]:
+    """
+    Score un bloc dans le processus de travail et écrit directement ses résultats sur disque,
+    sans les renvoyer au processus principal.
+
+    Retourne:
+        Tuple[int, float, Optional[int]]: Nombre de lignes scorées, durée (s) de scoring et d'écriture
+        et pic de mémoire (octets, None sans MEMORY_PROFILE)
+    """
+    start = time.perf_counter()
+    # Modèle préchargé par scoring_pool._init_worker au lancement du processus
+    bundle = _worker_bundle(loader, model_name, version)
+    with peak_memory() as memory:
+        results_df = predict(
+            df, SEUIL_DEFAUT, bundle, explain=explain, k=k, lean=lean, product_thresholds=product_thresholds
+        )
+        write_shard(results_df, shard_path, output_format)
+    return len(results_df), time.perf_counter() - start, memory["peak_bytes"]
+
+
+def write_shard(results_df: pd.DataFrame, path: str, output_format: str) -> None:
+    """
+    Écrit les résultats d'un bloc au format Parquet ou Arrow IPC (fichier), sans jamais laisser
+    de fichier partiel.
+    """
+    table = results_to_table(results_df)
+
+    def write(tmp_path: str) -> None:
+        if output_format == "arrow":
+            with pa.ipc.new_file(tmp_path, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            pq.write_table(table, tmp_path)
+
+    write_atomic(path, write)
+
+
+def score_file(
+    input_path: str,
+    output_dir: str,
+    version: str,
+    model_name: str = MODEL_NAME,
+    workers: int = None,
+    threads_per_worker: int = 1,
+    chunk_rows: int = 10000,
+    explain: str = "full",
+    k: int = 10,
+    output_format: str = "parquet",
+    lean: bool = False,
+    product_thresholds: Tuple[Tuple[str, float], ...] = (),
+    loader: Callable[[str, str], ModelBundle] = load_bundle,
+) -> dict:
+    """
+    Score un fichier CSV ou Parquet de taille quelconque dans un pool de processus.
+
+    Le processus principal lit le fichier par blocs de chunk_rows lignes et les valide ;
+    chaque processus de travail précharge le modèle une seule fois, score les blocs
+    qu'il reçoit et écrit un fichier de résultats par bloc (part-00000.parquet, ...).
+
+    Paramètres:
+        input_path: Fichier CSV ou Parquet des données clients
+        output_dir: Répertoire des fichiers de résultats
+        version: Version du modèle dans le registre MLflow ou l'instantané
+        model_name: Nom du modèle dans le registre MLflow
+        workers: Nombre de processus (par défaut le nombre de cœurs)
+        threads_per_worker: Threads de calcul de chaque processus (OMP_NUM_THREADS), pour le débit par cœur
+        chunk_rows: Nombre de lignes par bloc
+        explain, k: Options de scoring transmises à utilities.predict
+        output_format: "parquet" ou "arrow"
+        lean: Mode économe en mémoire de utilities.predict (float32, tampons réutilisés)
+        product_thresholds: Seuils par ligne de produit (voir utilities.parse_product_thresholds)
+        loader: Chargeur du modèle, comme celui de ModelRegistry : MLflow (load_bundle, adresse lue
+            dans MLFLOW_TRACKING_URI) ou instantané local (functools.partial(load_snapshot, path))
+
+    Retourne:
+        Dict: Résumé du scoring (lignes scorées et en erreur, débits, pic de mémoire par bloc
+        avec MEMORY_PROFILE, erreurs des blocs invalides)
+    """
+    workers = workers or os.cpu_count() or 1
+    extension = os.path.splitext(input_path.lower())[1]
+    if extension not in CHUNK_READERS:
+        raise ValueError(
+            f"Format de fichier non supporté ({input_path}). Veuillez fournir un fichier CSV ou Parquet."
+        )
+    os.makedirs(output_dir, exist_ok=True)
+
+    rows_total = 0
+    rows_scored = 0
+    worker_seconds = 0.0
+    peak_bytes = None
+    shards: List[str] = []
+    errors: List[dict] = []
+    in_flight = deque()
+
+    def collect() -> None:
+        nonlocal rows_scored, worker_seconds, peak_bytes
+        shard_path, chunk, future = in_flight.popleft()
+        try:
+            rows, seconds, shard_peak_bytes = future.result()
+        except Exception as e:
+            errors.append(
+                {"row_start": chunk.row_start, "row_end": chunk.row_end, "detail": f"Erreur lors du scoring: {e}"}
+            )
+            return
+        rows_scored += rows
+        worker_seconds += seconds
+        if shard_peak_bytes is not None:
+            peak_bytes = max(peak_bytes or 0, shard_peak_bytes)
+        shards.append(os.path.basename(shard_path))
+
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(loader, model_name, version),
+    )
+    with executor, open(input_path, "rb") as source:
+        chunks = iter_validated_chunks(CHUNK_READERS[extension](source, chunk_rows))
+        for chunk_index, chunk in enumerate(chunks):
+            rows_total = chunk.row_end
+            if chunk.error is not None:
+                errors.append(
+                    {"row_start": chunk.row_start, "row_end": chunk.row_end, "detail": chunk.error.detail}
+                )
+                continue
+
+            shard_path = os.path.join(output_dir, f"part-{chunk_index:05d}.{output_format}")
+            future = executor.submit(
+                _score_shard,
+                chunk.df,
+                shard_path,
+                loader,
+                model_name,
+                version,
+                explain,
+                k,
+                output_format,
+                lean,
+                product_thresholds,
+            )
+            in_flight.append((shard_path, chunk, future))
+            # Garder au plus deux blocs en attente par processus pour borner la mémoire
+            if len(in_flight) >= 2 * workers:
+                collect()
+
+        while len(in_flight) > 0:
+            collect()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "input": input_path,
+        "output_dir": output_dir,
+        "model_version": version,
+        "explain": explain,
+        "workers": workers,
+        "threads_per_worker": threads_per_worker,
+        "rows_total": rows_total,
+        "rows_scored": rows_scored,
+        "rows_failed": rows_total - rows_scored,
+        "shards": sorted(shards),
+        "elapsed_seconds": elapsed,
+        "rows_per_second": rows_scored / elapsed if elapsed > 0 else None,
+        # Débit d'un cœur : lignes scorées par seconde de calcul, chaque processus de travail
+        # occupant threads_per_worker cœurs
+        "rows_per_second_per_core": (
+            rows_scored / (worker_seconds * threads_per_worker) if worker_seconds > 0 else None
+        ),
+        # Mémoire à prévoir par processus en plus du modèle : pic alloué pendant le scoring d'un bloc
+        "peak_memory_bytes_per_chunk": peak_bytes,
+        "errors": errors,
+    }
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Score hors ligne un fichier CSV ou Parquet de clients avec le pipeline de l'API."
+    )
+    parser.add_argument("input", help="Fichier CSV ou Parquet des données clients")
+    parser.add_argument("output_dir", help="Répertoire des fichiers de résultats")
+    parser.add_argument("--model-version", help="Version du modèle (par défaut la dernière version enregistrée)")
+    parser.add_argument("--model-name", default=MODEL_NAME, help="Nom du modèle dans le registre MLflow")
+    parser.add_argument("--tracking-uri", help="Registre MLflow (par défaut MLFLOW_TRACKING_URI)")
+    parser.add_argument(
+        "--snapshot", help="Instantané local du modèle (voir snapshot.py), utilisé à la place du registre MLflow"
+    )
+    parser.add_argument("--workers", type=int, help="Nombre de processus (par défaut le nombre de cœurs)")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="Threads de calcul par processus")
+    parser.add_argument("--chunk-rows", type=int, default=10000, help="Nombre de lignes par bloc")
+    parser.add_argument("--explain", choices=EXPLAIN_MODES, default="full", help="Mode d'explication (voir /predict)")
+    parser.add_argument("-k", type=int, default=10, help="Nombre de variables avec --explain topk")
+    parser.add_argument("--no-shap", action="store_true", help="Probabilité et classe uniquement (--explain none)")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet", help="Format des fichiers de résultats")
+    parser.add_argument("--lean", action="store_true", help="Scoring économe en mémoire (float32, tampons réutilisés)")
+    parser.add_argument(
+        "--product-thresholds",
+        default="",
+        help='Seuils par ligne de produit en JSON, par exemple \'{"Revolving loans": 0.4}\'',
+    )
+    parser.add_argument(
+        "--memory-profile", action="store_true", help="Mesurer le pic de mémoire de chaque bloc (plus lent)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    if args.tracking_uri:
+        # Lu par MLflow dans ce processus et dans les processus de travail
+        os.environ["MLFLOW_TRACKING_URI"] = args.tracking_uri
+
+    # Limiter les threads de LightGBM dans chaque processus (lu au lancement des processus)
+    # pour ne pas avoir plus de threads de calcul que de cœurs
+    os.environ["OMP_NUM_THREADS"] = str(args.threads_per_worker)
+    if args.memory_profile:
+        # Lu par le module metrics à l'import, dans chaque processus de travail
+        os.environ["MEMORY_PROFILE"] = "1"
+
+    try:
+        product_thresholds = parse_product_thresholds(args.product_thresholds)
+    except ValueError as e:
+        print(f"Erreur: {e}", file=sys.stderr)
+        return 2
+
+    if args.snapshot:
+        # Charger le modèle depuis l'instantané, sans accès au registre MLflow
+        loader = partial(load_snapshot, args.snapshot)
+        try:
+            version = snapshot_version(args.snapshot, args.model_name)
+        except (OSError, ValueError) as e:
+            print(f"Erreur: {e}", file=sys.stderr)
+            return 2
+        if args.model_version and args.model_version != version:
+            print(
+                f"Erreur: l'instantané {args.snapshot} contient la version {version} et non {args.model_version}",
+                file=sys.stderr,
+            )
+            return 2
+    else:
+        loader = load_bundle
+        version = args.model_version or resolve_latest_version(args.model_name)
+    try:
+        summary = score_file(
+            args.input,
+            args.output_dir,
+            version,
+            model_name=args.model_name,
+            workers=args.workers,
+            threads_per_worker=args.threads_per_worker,
+            chunk_rows=args.chunk_rows,
+            explain="none" if args.no_shap else args.explain,
+            k=args.k,
+            output_format=args.format,
+            lean=args.lean,
+            product_thresholds=product_thresholds,
+            loader=loader,
+        )
+    except (SchemaError, ValueError) as e:
+        print(f"Erreur: {e}", file=sys.stderr)
+        return 2
+
+    # Enregistrer le résumé avec les résultats et l'afficher
+    with open(os.path.join(args.output_dir, "_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print(
+        f"{summary['rows_scored']} lignes scorées ({summary['rows_failed']} en erreur) en "
+        f"{summary['elapsed_seconds']:.1f} s avec {summary['workers']} processus : "
+        f"{summary['rows_per_second'] or 0:.0f} lignes/s, "
+        f"{summary['rows_per_second_per_core'] or 0:.0f} lignes/s par cœur"
+    )
+    if summary["peak_memory_bytes_per_chunk"] is not None:
+        print(f"Pic de mémoire par bloc : {summary['peak_memory_bytes_per_chunk'] / 2**20:.1f} Mo")
+    return 0 if summary["rows_failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
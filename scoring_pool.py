@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from challengers import ChallengerScorer
+from metrics import BATCH_ROWS, PEAK_MEMORY_BYTES, ROWS_SCORED, peak_memory, record_stages, span
+from model_registry import ModelBundle, ModelRegistry
+from utilities import predict, predict_records
+
+logger = logging.getLogger(__name__)
+
+# Modèles préchargés dans chaque processus de travail, indexés par version
+_worker_bundles: Dict[str, ModelBundle] = {}
+
+
+class PoolSaturated(Exception):
+    """
+    Levée lorsque le nombre de requêtes en attente de scoring atteint la limite configurée.
+    """
+
+
+# Délai maximal (s) du préchargement d'une nouvelle version dans tous les processus de travail
+PRELOAD_TIMEOUT = 600.0
+
+
+def _init_worker(
+    loader: Callable[[str, str], ModelBundle], model_name: str, version: str, ready=None
+) -> None:
+    """
+    Initialise un processus de travail en préchargeant la version servie du modèle avec le
+    chargeur du registre (MLflow, dont l'adresse est lue dans MLFLOW_TRACKING_URI, ou instantané local).
+    Avec ready (multiprocessing.Barrier), attend que tous les processus du pool aient chargé le modèle.
+    """
+    _worker_bundles[version] = loader(version, model_name)
+    if ready is not None:
+        ready.wait(PRELOAD_TIMEOUT)
+
+
+def _worker_bundle(
+    loader: Callable[[str, str], ModelBundle],
+    model_name: str,
+    version: str,
+    timings: Dict[str, float] = None,
+) -> ModelBundle:
+    """
+    Retourne le modèle du processus de travail, rechargé si le registre a changé de version.
+    """
+    bundle = _worker_bundles.get(version)
+    if bundle is None:
+        # Ne garder qu'une version en mémoire dans chaque processus
+        _worker_bundles.clear()
+        with span(timings, "model_load"):
+            bundle = loader(version, model_name)
+        _worker_bundles[version] = bundle
+    return bundle
+
+
+def _predict_with_timings(
+    df: pd.DataFrame,
+    seuil: float,
+    bundle: ModelBundle,
+    options: dict,
+    timings: Dict[str, float] = None,
+    records: bool = False,
+) -> Tuple[Union[pd.DataFrame, List[dict]], Dict[str, float], Optional[int]]:
+    timings = {} if timings is None else timings
+    scorer = predict_records if records else predict
+    with peak_memory() as memory:
+        results = scorer(df, seuil, bundle, timings=timings, **options)
+    return results, timings, memory["peak_bytes"]
+
+
+def _predict_in_worker(
+    df: pd.DataFrame,
+    seuil: float,
+    loader: Callable[[str, str], ModelBundle],
+    model_name: str,
+    version: str,
+    options: dict,
+    records: bool = False,
+) -> Tuple[Union[pd.DataFrame, List[dict]], Dict[str, float], Optional[int]]:
+    timings: Dict[str, float] = {}
+    bundle = _worker_bundle(loader, model_name, version, timings)
+    return _predict_with_timings(df, seuil, bundle, options, timings, records)
+
+
+def _record_batch(explain: str, future: Future) -> None:
+    # Exporter les durées des étapes, le nombre de lignes scorées et le pic de mémoire d'un lot terminé
+    if future.cancelled() or future.exception() is not None:
+        return
+    results, timings, peak_bytes = future.result()
+    record_stages(timings)
+    ROWS_SCORED.labels(explain).inc(len(results))
+    if peak_bytes is not None:
+        PEAK_MEMORY_BYTES.labels(explain).observe(peak_bytes)
+
+
+class ScoringPool:
+    """
+    Exécute le scoring hors de la boucle asyncio dans un pool de threads ou de processus.
+
+    En mode processus, une nouvelle version du registre est préchargée dans un nouveau pool
+    de processus pendant que l'ancien continue de scorer : les lots ne sont confiés à la
+    nouvelle version qu'une fois chargée dans tous les processus (voir current).
+
+    Le nombre de places occupées (une par lot du MicroBatcher, par flux ou par requête
+    JSON) est borné à workers + max_queue : au-delà, admission() lève PoolSaturated pour
+    que l'API réponde 503 au lieu de laisser la file d'attente grandir. Avec lean, les lots sont scorés par le mode économe
+    en mémoire de utilities.predict, avec product_thresholds le seuil dépend de la
+    ligne de produit. Avec challengers, chaque lot scoré est ensuite comparé en
+    arrière-plan aux versions challengers.
+    """
+
+    def __init__(
+        self,
+        registry: ModelRegistry,
+        kind: str = "thread",
+        workers: int = None,
+        max_queue: int = None,
+        lean: bool = False,
+        product_thresholds: Tuple[Tuple[str, float], ...] = (),
+        challengers: ChallengerScorer = None,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Type de pool inconnu: {kind} (attendu: thread ou process)")
+        self.registry = registry
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 2 if max_queue is None else max_queue
+        self.lean = lean
+        self.product_thresholds = product_thresholds
+        self.challengers = challengers
+        self._executor: Executor = None
+        # Version servie par le pool de processus et verrou de la bascule vers une nouvelle version
+        self._bundle: Optional[ModelBundle] = None
+        self._swap_lock = threading.Lock()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Crée le pool. En mode processus, chaque processus précharge la version servie du modèle,
+        et les versions suivantes sont préchargées à chaque changement de version du registre.
+        """
+        if self.kind == "process":
+            self._bundle = self.registry.current()
+            self._executor = self._process_executor(self._bundle.version)
+            self.registry.add_listener(self._preload)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="scoring"
+            )
+
+    def stop(self) -> None:
+        with self._swap_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def current(self) -> ModelBundle:
+        """
+        Retourne la version du modèle servie par le pool. En mode processus, une nouvelle version
+        du registre n'est servie qu'une fois préchargée dans tous les processus de travail.
+        """
+        if self.kind == "process" and self._bundle is not None:
+            return self._bundle
+        return self.registry.current()
+
+    def _process_executor(self, version: str, ready=None) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.registry.loader, self.registry.model_name, version, ready),
+        )
+
+    def _preload(self, bundle: ModelBundle) -> None:
+        """
+        Listener du registre en mode processus : charge la nouvelle version dans un nouveau pool de
+        processus, puis lui confie les lots suivants. L'ancien pool termine ses lots en cours.
+        En cas d'échec, la nouvelle version est servie par l'ancien pool (rechargée à la première requête).
+        """
+        if self._executor is None or bundle.version == self._bundle.version:
+            return
+        start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        executor = self._process_executor(bundle.version, context.Barrier(self.workers))
+        try:
+            # Une tâche par processus : chacune démarre un processus, qui ne l'exécute qu'une fois
+            # tous les processus prêts
+            for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+        except Exception:
+            logger.exception("Échec du préchargement de la version %s dans les processus de scoring", bundle.version)
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = None
+
+        with self._swap_lock:
+            if self._executor is None:
+                # Pool arrêté pendant le préchargement
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                return
+            old_executor = None
+            if executor is not None:
+                old_executor, self._executor = self._executor, executor
+            self._bundle = bundle
+        if old_executor is not None:
+            # Les lots déjà soumis à l'ancien pool se terminent avant l'arrêt de ses processus
+            old_executor.shutdown(wait=False)
+            logger.info(
+                "Version %s préchargée dans %d processus de scoring en %.1f s",
+                bundle.version,
+                self.workers,
+                time.perf_counter() - start,
+            )
+
+    @contextmanager
+    def admission(self):
+        """
+        Réserve une place dans le pool pour la durée d'un lot, d'un flux ou d'une requête JSON.
+        Lève PoolSaturated si toutes les places sont occupées.
+        """
+        with self._pending_lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise PoolSaturated()
+            self._pending += 1
+        try:
+            yield
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+
+    def submit(
+        self, df: pd.DataFrame, seuil: float, bundle: ModelBundle = None, records: bool = False, **options
+    ) -> Tuple[Future, str]:
+        """
+        Soumet le scoring de df au pool avec bundle, ou la version servie au moment de l'appel (current).
+        Les options supplémentaires sont transmises à utilities.predict, ou à utilities.predict_records
+        avec records (chemin à faible latence, sans mode économe).
+        Les durées des étapes et le nombre de lignes scorées sont exportés à la fin du scoring.
+
+        Retourne:
+            Future des résultats (DataFrame, ou liste de dictionnaires avec records), des durées (s)
+            des étapes du scoring et du pic de mémoire (octets, None sans MEMORY_PROFILE), et
+            version du modèle utilisée
+        """
+        options = {"product_thresholds": self.product_thresholds, **options}
+        if not records:
+            options = {"lean": self.lean, **options}
+        compare = self.challengers is not None and self.challengers.enabled
+        transformed = None
+        if compare and self.kind == "thread":
+            # Récupérer la matrice transformée du champion pour que les challengers la réutilisent
+            transformed = {}
+            options["transformed"] = transformed
+        if self.kind == "process":
+            # Lire la version servie et soumettre au pool correspondant sans être interrompu par une bascule
+            with self._swap_lock:
+                bundle = bundle or self.current()
+                future = self._executor.submit(
+                    _predict_in_worker,
+                    df,
+                    seuil,
+                    self.registry.loader,
+                    self.registry.model_name,
+                    bundle.version,
+                    options,
+                    records,
+                )
+        else:
+            bundle = bundle or self.current()
+            future = self._executor.submit(_predict_with_timings, df, seuil, bundle, options, None, records)
+        BATCH_ROWS.observe(len(df))
+        future.add_done_callback(partial(_record_batch, options.get("explain", "full")))
+        if compare:
+            future.add_done_callback(
+                partial(self.challengers.submit_future, df, seuil, bundle.version, transformed)
+            )
+        return future, bundle.version
+
+    async def predict(
+        self, df: pd.DataFrame, seuil: float, bundle: ModelBundle = None, **options
+    ) -> Tuple[Union[pd.DataFrame, List[dict]], str, Dict[str, float]]:
+        """
+        Version asynchrone de submit : attend le résultat sans bloquer la boucle asyncio.
+
+        Retourne:
+            Résultats (voir submit), version du modèle utilisée et durées (s) des étapes du scoring
+        """
+        start = time.perf_counter()
+        future, version = self.submit(df, seuil, bundle, **options)
+        results, timings, _ = await asyncio.wrap_future(future)
+
+        # Temps passé hors du scoring lui-même : attente d'un worker et transfert des données
+        pool_wait = {"pool_wait": max(time.perf_counter() - start - sum(timings.values()), 0.0)}
+        record_stages(pool_wait)
+        return results, version, {**pool_wait, **timings}
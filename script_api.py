@@ -1,129 +1,779 @@
+import asyncio
+import io
+import logging
+import os
+import time
+from contextlib import ExitStack, asynccontextmanager
+import numpy as np
 import pandas as pd
-from utilities import predict
-import mlflow
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from model_registry import ModelRegistry
+from snapshot import DEFAULT_WARMUP_SOURCE, read_clients_file, read_warmup_frame, snapshot_registry
+from scoring_pool import ScoringPool, PoolSaturated
+from dispatcher import MicroBatcher
+from prediction_cache import PredictionCache
+from schema import SCHEMA, SchemaError
+from streaming import CHUNK_READERS, iter_validated_chunks
+from jobs import JobStore, JobRunner
+from challengers import ChallengerScorer, parse_versions
+from metrics import (
+    CHUNK_ERRORS,
+    add_timings,
+    elapsed_since_request_start,
+    record_response,
+    record_stages,
+    request_timings,
+    server_timing_header,
+    start_request,
+    timed,
+)
+from utilities import SEUIL_DEFAUT, parse_product_thresholds
+from serialization import (
+    ARROW_STREAM_MEDIA_TYPE,
+    CSV_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    PARQUET_MEDIA_TYPES,
+    negotiate_stream_format,
+    stream_error,
+    to_csv_rows,
+    to_ndjson,
+    negotiate_format,
+    to_arrow_ipc,
+    to_json_columnar,
+    to_json_records,
+    to_parquet,
+)
+from typing import List, Literal
+import orjson
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response, Query, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import uvicorn
 
-# Configurer le chemin MLflow pour accéder au modèle enregistré
-mlflow.set_tracking_uri(
-    "file:///Users/zi/Documents/OC - Data Scientist/Projet 7/mlruns"
+logger = logging.getLogger(__name__)
+
+# Configurer le chemin MLflow pour accéder au modèle enregistré. Passé par l'environnement,
+# il est lu par MLflow (importé seulement au chargement du modèle) et par les processus de scoring
+os.environ.setdefault(
+    "MLFLOW_TRACKING_URI", "file:///Users/zi/Documents/OC - Data Scientist/Projet 7/mlruns"
+)
+
+# Instantané local du modèle (voir snapshot.py) : s'il est fourni, l'API démarre sans MLflow
+MODEL_SNAPSHOT = os.environ.get("MODEL_SNAPSHOT")
+
+# Charger le modèle une seule fois et surveiller l'apparition de nouvelles versions
+if MODEL_SNAPSHOT:
+    registry = snapshot_registry(MODEL_SNAPSHOT)
+else:
+    registry = ModelRegistry(
+        poll_interval=float(os.environ.get("MODEL_POLL_INTERVAL", "60"))
+    )
+
+# Scorer les lots en float32 dans des tampons réutilisés pour réduire la mémoire par worker
+LEAN_SCORING = os.environ.get("LEAN_SCORING", "0").lower() in ("1", "true", "yes")
+
+# Seuils par ligne de produit (NAME_CONTRACT_TYPE), en JSON : {"Revolving loans": 0.4} ;
+# les produits absents gardent SEUIL_DEFAUT
+PRODUCT_THRESHOLDS = parse_product_thresholds(os.environ.get("PRODUCT_THRESHOLDS", ""))
+
+# Versions challengers scorées en arrière-plan sur les mêmes clients que le modèle servi,
+# séparées par des virgules ("3,4"), et répertoire des résultats à comparer hors ligne
+challengers = ChallengerScorer(
+    parse_versions(os.environ.get("CHALLENGER_VERSIONS", "")),
+    os.environ.get("CHALLENGER_LOG_DIR", "challengers"),
+    model_name=registry.model_name,
+    product_thresholds=PRODUCT_THRESHOLDS,
+)
+
+# Scorer dans un pool de threads ou de processus pour ne pas bloquer la boucle asyncio
+scoring_pool = ScoringPool(
+    registry,
+    kind=os.environ.get("SCORING_EXECUTOR", "thread"),
+    workers=int(os.environ["SCORING_WORKERS"]) if "SCORING_WORKERS" in os.environ else None,
+    max_queue=int(os.environ["SCORING_MAX_QUEUE"]) if "SCORING_MAX_QUEUE" in os.environ else None,
+    lean=LEAN_SCORING,
+    product_thresholds=PRODUCT_THRESHOLDS,
+    challengers=challengers,
 )
 
+# Regrouper les requêtes concurrentes en lots scorés en un seul appel
+batcher = MicroBatcher(
+    scoring_pool,
+    window_ms=float(os.environ.get("BATCH_WINDOW_MS", "0")),
+    max_batch_rows=int(os.environ.get("BATCH_MAX_ROWS", "1000")),
+    max_queued_rows=int(os.environ["BATCH_MAX_QUEUED_ROWS"]) if "BATCH_MAX_QUEUED_ROWS" in os.environ else None,
+)
+
+# Mettre en cache les résultats des lignes déjà scorées, vidé à chaque nouvelle version du modèle
+cache = PredictionCache(
+    max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "100000")),
+    max_bytes=int(float(os.environ.get("CACHE_MAX_MB", "256")) * 1024 * 1024),
+    ttl=float(os.environ.get("CACHE_TTL_SECONDS", "600")),
+)
+registry.add_listener(cache.clear)
+
+# Nombre de lignes lues, validées et scorées à la fois par /predict/stream
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", "1000"))
+
+# Ajouter aux réponses l'en-tête Server-Timing détaillant la durée de chaque étape
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+# Tâches de scoring en arrière-plan, stockées sur disque et scorées dans un pool dédié
+job_store = JobStore(os.environ.get("JOBS_DIR", "jobs"))
+job_pool = ScoringPool(
+    registry,
+    kind=os.environ.get("SCORING_EXECUTOR", "thread"),
+    workers=int(os.environ["JOBS_WORKERS"]) if "JOBS_WORKERS" in os.environ else None,
+    lean=LEAN_SCORING,
+    product_thresholds=PRODUCT_THRESHOLDS,
+)
+job_runner = JobRunner(
+    job_store, job_pool, chunk_rows=int(os.environ.get("JOBS_CHUNK_ROWS", "5000"))
+)
+
+
+# Clients scorés au démarrage (vide pour désactiver le préchauffage) ; par défaut ceux de l'instantané
+WARMUP_FILE = os.environ.get("WARMUP_FILE")
+
+# État du démarrage exposé par /health/live et /health/ready : starting, ready, failed ou stopping
+startup_state = {"status": "starting", "detail": None, "startup_seconds": None, "warmup_seconds": None}
+
+
+def load_warmup_frame() -> pd.DataFrame:
+    """
+    Retourne les clients de préchauffage : WARMUP_FILE, sinon ceux de l'instantané,
+    sinon le fichier de test du dépôt. None si aucun n'est disponible.
+    """
+    if WARMUP_FILE is not None:
+        return read_clients_file(WARMUP_FILE, max_rows=10) if WARMUP_FILE else None
+    if MODEL_SNAPSHOT:
+        df = read_warmup_frame(MODEL_SNAPSHOT)
+        if df is not None:
+            return df
+    if os.path.exists(DEFAULT_WARMUP_SOURCE):
+        return read_clients_file(DEFAULT_WARMUP_SOURCE, max_rows=10)
+    return None
+
+
+async def warm_up() -> None:
+    """
+    Score des clients sans et avec SHAP puis encode les résultats, pour que la première requête
+    ne paie pas l'initialisation de LightGBM, de l'explainer SHAP et des sérialiseurs.
+    En mode processus, chaque processus de travail reçoit un lot.
+    """
+    df = await run_in_threadpool(load_warmup_frame)
+    if df is None:
+        logger.warning("Aucun client de préchauffage : la première requête initialisera le modèle")
+        return
+
+    start = time.perf_counter()
+    with timed("warmup"):
+        copies = scoring_pool.workers if scoring_pool.kind == "process" else 1
+        for explain in ("none", "full"):
+            results = await asyncio.gather(
+                *(scoring_pool.predict(df, SEUIL_DEFAUT, explain=explain) for _ in range(copies))
+            )
+            await run_in_threadpool(to_json_records, results[0][0])
+    startup_state["warmup_seconds"] = time.perf_counter() - start
+
+
+async def start_serving() -> None:
+    """
+    Charge le modèle, démarre les pools et les tâches en attente puis préchauffe le scoring
+    avant de déclarer l'API prête. En cas d'échec, /health/live répond 503 pour que l'API soit redémarrée.
+    """
+    start = time.perf_counter()
+    try:
+        # Le chargement du modèle bloque (imports, lecture du pipeline, explainer SHAP) : le faire dans un thread
+        await run_in_threadpool(registry.start)
+        scoring_pool.start()
+        await batcher.start()
+        job_pool.start()
+        job_runner.start()
+        await warm_up()
+    except Exception as e:
+        logger.exception("Échec du démarrage de l'API")
+        startup_state.update(status="failed", detail=f"{type(e).__name__}: {e}")
+        return
+
+    # Démarrer les challengers après le préchauffage, qui n'est pas comparé ; leur échec
+    # n'empêche pas de servir le modèle
+    try:
+        await run_in_threadpool(challengers.start)
+    except Exception:
+        logger.exception("Échec du chargement des versions challengers, scorées uniquement par le modèle servi")
+    startup_state.update(status="ready", startup_seconds=time.perf_counter() - start)
+    logger.info("API prête en %.1f s", startup_state["startup_seconds"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Démarrer en arrière-plan pour que /health/live réponde pendant le chargement du modèle ;
+    # les endpoints de scoring répondent 503 jusqu'à la fin du préchauffage
+    startup_task = asyncio.create_task(start_serving())
+    yield
+    # Ne plus se déclarer prête pendant l'arrêt, puis arrêter ce qui a été démarré
+    startup_state["status"] = "stopping"
+    startup_task.cancel()
+    try:
+        await startup_task
+    except asyncio.CancelledError:
+        pass
+    job_runner.stop()
+    job_pool.stop()
+    await batcher.stop()
+    scoring_pool.stop()
+    challengers.stop()
+    registry.stop()
+
+
 # Créer l'instance FastAPI avec métadonnées pour la documentation automatique
 app = FastAPI(
     title="Prédiction Défaut Crédit API",
     description="API permettant de prédire le risque de défaut d'un client avec le poids de chaque variable",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    Suit la durée des étapes de chaque requête et exporte sa durée totale et son code HTTP.
+    """
+    timings = start_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        record_response(route_path(request), 500, time.perf_counter() - start)
+        raise
+    total = time.perf_counter() - start
+    record_response(route_path(request), response.status_code, total)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(timings, total)
+    return response
+
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    """
+    Répond 503 lorsque le pool de scoring n'a plus de place, quel que soit l'endpoint.
+    """
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Le service est saturé. Veuillez réessayer dans quelques instants."},
+        headers={"Retry-After": "1"},
+    )
+
+
+def require_ready() -> None:
+    """
+    Répond 503 aux requêtes de scoring tant que le modèle n'est pas chargé et préchauffé.
+    """
+    if startup_state["status"] != "ready":
+        raise HTTPException(
+            status_code=503,
+            detail="Le modèle est en cours de chargement. Veuillez réessayer dans quelques instants.",
+            headers={"Retry-After": "5"},
+        )
+
+
+def route_path(request: Request) -> str:
+    # Regrouper les métriques par route (/jobs/{job_id}) plutôt que par URL
+    route = request.scope.get("route")
+    return route.path if route is not None else "other"
+
+
+# Modèle pydantic d'un client construit à partir du schéma, pour les endpoints JSON
+Applicant = SCHEMA.build_record_model("Applicant")
+
+# Lecteurs des formats de fichier acceptés, selon l'extension du fichier uploadé
+READERS = {
+    ".csv": SCHEMA.read_csv,
+    ".parquet": SCHEMA.read_parquet,
+    ".arrow": SCHEMA.read_arrow,
+    ".arrows": SCHEMA.read_arrow,
+    ".feather": SCHEMA.read_arrow,
+}
+
+
+def read_and_validate_upload(file: UploadFile) -> pd.DataFrame:
+    """
+    Lit le fichier uploadé (CSV, Parquet ou Arrow IPC) et vérifie son contenu avant le scoring.
+    Les codes d'erreur (400 fichier illisible ou vide, colonnes manquantes, ID manquants ou types
+    invalides, 413 fichier trop volumineux) sont ceux levés par le schéma.
+    Exécutée hors de la boucle asyncio car la lecture et les conversions sont coûteuses.
+    Paramètre: file: Fichier contenant les données clients
+    Retourne: pd.DataFrame: Données clients aux types attendus par le modèle
+    """
+
+    try:
+        # Lire uniquement les colonnes du schéma avec le lecteur correspondant au format
+        reader = READERS[os.path.splitext(file.filename.lower())[1]]
+        with timed("read_file"):
+            df = reader(file.file)
+
+        # Vérifier le contenu et convertir les colonnes aux types attendus en une seule passe
+        with timed("validate"):
+            df = SCHEMA.validate(df, max_rows=1000)
+    except SchemaError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    return df
+
+
+def lookup_cache(scope: tuple, df: pd.DataFrame):
+    """
+    Calcule le hash des lignes et récupère celles déjà scorées dans le cache.
+    Retourne: Tuple[np.ndarray, List]: Hash des lignes et lignes de résultats en cache (None si absentes)
+    """
+    hashes = cache.row_hashes(df)
+    return hashes, cache.get_many(scope, hashes)
+
+
+def merge_cached_results(
+    df: pd.DataFrame, cached_rows: list, hit_mask: np.ndarray, miss_results_df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Fusionne les résultats en cache et les résultats calculés (None si toutes les lignes
+    sont en cache) dans l'ordre des lignes de df.
+    """
+    hits_df = cache.build_frame(
+        [row for row in cached_rows if row is not None],
+        index=pd.Index(df["SK_ID_CURR"].to_numpy()[hit_mask], name="SK_ID_CURR"),
+    )
+    if miss_results_df is None:
+        return hits_df
+    positions = np.concatenate([np.flatnonzero(hit_mask), np.flatnonzero(~hit_mask)])
+    return pd.concat([hits_df, miss_results_df]).iloc[np.argsort(positions, kind="stable")]
+
+
+async def score_with_cache(df: pd.DataFrame, seuil: float, explain: str, k: int):
+    """
+    Score df en ne calculant que les lignes absentes du cache.
+    Retourne: Tuple[pd.DataFrame, str]: Résultats dans l'ordre de df et version du modèle utilisée
+    """
+    if not cache.enabled:
+        return await batcher.predict(df, seuil, explain=explain, k=k)
+
+    # Servir depuis le cache les lignes déjà scorées avec la version actuelle du modèle
+    version = scoring_pool.current().version
+    scope = (version, seuil, explain, k)
+    with timed("cache_lookup"):
+        hashes, cached_rows = await run_in_threadpool(lookup_cache, scope, df)
+    hit_mask = np.array([row is not None for row in cached_rows])
+    if hit_mask.all():
+        return await run_in_threadpool(
+            merge_cached_results, df, cached_rows, hit_mask, None
+        ), version
+
+    # Scorer uniquement les lignes absentes du cache
+    miss_df = df[~hit_mask] if hit_mask.any() else df
+    miss_results_df, miss_version = await batcher.predict(miss_df, seuil, explain=explain, k=k)
+    cache_scope = (miss_version, seuil, explain, k)
+    await run_in_threadpool(cache.put_many, cache_scope, hashes[~hit_mask], miss_results_df)
+
+    if not hit_mask.any():
+        return miss_results_df, miss_version
+    if miss_version != version:
+        # Le modèle a changé entre la lecture du cache et le scoring : tout rescorer avec la nouvelle version
+        return await batcher.predict(df, seuil, explain=explain, k=k)
+
+    return await run_in_threadpool(
+        merge_cached_results, df, cached_rows, hit_mask, miss_results_df
+    ), version
+
+
 # Définir le endpoint POST sur la route "/predict"
-@app.post("/predict")
-async def predict_endpoint(file: UploadFile = File(...)):
+@app.post("/predict", dependencies=[Depends(require_ready)])
+async def predict_endpoint(
+    request: Request,
+    file: UploadFile = File(...),
+    explain: Literal["none", "topk", "full"] = Query("full"),
+    k: int = Query(10, ge=1),
+    layout: Literal["records", "columnar"] = Query("records"),
+):
     """
     Endpoint de prédiction pour le risque de défaut de crédit
-    Paramètre: file: Fichier CSV contenant les données clients
-    Retourne: List[Dict]: Résultats avec prédictions et valeurs SHAP par client
+    Paramètres:
+        file: Fichier CSV, Parquet (.parquet) ou Arrow IPC (.arrow, .arrows, .feather) contenant les données clients
+        explain: "none" (probabilité et classe uniquement), "topk" (k plus fortes contributions SHAP)
+            ou "full" (valeurs SHAP de toutes les variables, par défaut)
+        k: Nombre de variables retournées avec explain="topk"
+        layout: Disposition de la réponse JSON : "records" (une entrée par client, par défaut)
+            ou "columnar" (identifiants, noms des variables et matrice des valeurs)
+    Retourne: List[Dict]: Résultats avec prédictions et valeurs SHAP par client, ou un flux Arrow IPC
+        (Accept: application/vnd.apache.arrow.stream) ou un fichier Parquet (Accept: application/vnd.apache.parquet)
+    La version du modèle utilisée est indiquée dans l'en-tête X-Model-Version
     """
 
+    # Temps de réception et de décodage du fichier avant l'appel de l'endpoint
+    record_stages({"upload": elapsed_since_request_start()}, [request_timings()])
+
     # Vérifier l'extension du fichier
-    if not file.filename.lower().endswith(".csv"):
+    if os.path.splitext(file.filename.lower())[1] not in READERS:
         raise HTTPException(
             status_code=422,
-            detail=f"Format de fichier non supporté ({file.filename}). Veuillez fournir un fichier CSV."
+            detail=f"Format de fichier non supporté ({file.filename}). Veuillez fournir un fichier CSV, Parquet ou Arrow."
+        )
+
+    # Lire et valider le fichier dans un thread pour ne pas bloquer les autres connexions
+    df = await run_in_threadpool(read_and_validate_upload, file)
+
+    # Effectuer la prédiction des lignes absentes du cache dans le pool, regroupée avec
+    # les requêtes concurrentes, avec la version du modèle servie au moment du scoring.
+    # Le batcher répond 503 (PoolSaturated) lorsque trop de lignes sont en attente
+    results_df, version = await score_with_cache(df, SEUIL_DEFAUT, explain, k)
+
+    # Retourner un format colonnaire si le client le demande
+    output_format = negotiate_format(request.headers.get("accept"))
+    with timed("encode"):
+        if output_format == "arrow":
+            content = await run_in_threadpool(to_arrow_ipc, results_df)
+            media_type = ARROW_STREAM_MEDIA_TYPE
+        elif output_format == "parquet":
+            content = await run_in_threadpool(to_parquet, results_df)
+            media_type = PARQUET_MEDIA_TYPES[0]
+        elif layout == "columnar":
+            # Sérialiser directement en JSON sans passer par jsonable_encoder
+            content = await run_in_threadpool(to_json_columnar, results_df, explain)
+            media_type = "application/json"
+        else:
+            content = await run_in_threadpool(to_json_records, results_df)
+            media_type = "application/json"
+    return Response(content, media_type=media_type, headers={"X-Model-Version": version})
+
+
+def frame_from_applicants(applicants: list) -> pd.DataFrame:
+    """
+    Construit le DataFrame des clients reçus en JSON (déjà validés par le modèle Applicant).
+    """
+    with timed("validate"):
+        return SCHEMA.frame_from_records([applicant.model_dump() for applicant in applicants])
+
+
+async def score_applicants(applicants: list, explain: str, k: int):
+    """
+    Score des clients reçus en JSON dans le pool de scoring, sans lecture de fichier,
+    regroupement ni cache : chemin à faible latence pour quelques clients, dont le
+    prétraitement est précalculé (voir utilities.predict_records).
+    Retourne: Tuple[List[Dict], str]: Résultats par client et version du modèle utilisée
+    """
+    with scoring_pool.admission():
+        df = await run_in_threadpool(frame_from_applicants, applicants)
+        records, version, timings = await scoring_pool.predict(
+            df, SEUIL_DEFAUT, records=True, explain=explain, k=k
         )
+    add_timings(timings, [request_timings()])
+    return records, version
+
+
+# Définir le endpoint POST sur la route "/predict/one"
+@app.post("/predict/one", dependencies=[Depends(require_ready)])
+async def predict_one_endpoint(
+    applicant: Applicant,
+    explain: Literal["none", "topk", "full"] = Query("full"),
+    k: int = Query(10, ge=1),
+):
+    """
+    Endpoint de prédiction à faible latence pour un seul client
+    Paramètres:
+        applicant: Données du client (colonnes du schéma, null accepté hors colonnes entières)
+        explain, k: Voir /predict
+    Retourne: Dict: Prédiction et valeurs SHAP du client, avec les mêmes clés que /predict
+    """
+    records, version = await score_applicants([applicant], explain, k)
+    with timed("encode"):
+        content = orjson.dumps(records[0])
+    return Response(content, media_type="application/json", headers={"X-Model-Version": version})
 
-    # Lire le fichier uploadé
-    df = pd.read_csv(file.file)
 
-    # Vérifier que le fichier n'est pas vide
-    if df.shape[0] == 0:
+# Définir le endpoint POST sur la route "/predict/json"
+@app.post("/predict/json", dependencies=[Depends(require_ready)])
+async def predict_json_endpoint(
+    applicants: List[Applicant],
+    explain: Literal["none", "topk", "full"] = Query("full"),
+    k: int = Query(10, ge=1),
+):
+    """
+    Endpoint de prédiction à faible latence pour une liste de clients en JSON
+    Paramètres:
+        applicants: Liste des données clients (1 000 au maximum)
+        explain, k: Voir /predict
+    Retourne: List[Dict]: Prédictions et valeurs SHAP par client, avec les mêmes clés que /predict
+    """
+    if len(applicants) == 0:
         raise HTTPException(
             status_code=400,
-            detail="Le fichier CSV est vide. Veuillez fournir un fichier contenant des données."
+            detail="La requête ne contient aucun client. Veuillez fournir au moins un client."
         )
-
-    # Vérifier que le fichier n'est pas trop volumineux
-    if df.shape[0] > 1000:
+    if len(applicants) > 1000:
         raise HTTPException(
             status_code=413,
-            detail=f"Le fichier est trop volumineux ({df.shape[0]} lignes). Maximum autorisé: 1 000 lignes."
+            detail=f"La requête contient trop de clients ({len(applicants)}). Maximum autorisé: 1 000 clients."
         )
-    
-    # Vérifier que le fichier contient toutes les colonnes nécessaires
-    needed_columns = {
-        'SK_ID_CURR': 'int64', 'NAME_CONTRACT_TYPE': 'object', 'CODE_GENDER': 'object', 'FLAG_OWN_CAR': 'object', 'FLAG_OWN_REALTY': 'object',
-        'CNT_CHILDREN': 'int64', 'AMT_INCOME_TOTAL': 'float64', 'AMT_CREDIT': 'float64', 'AMT_ANNUITY': 'float64', 'AMT_GOODS_PRICE': 'float64',
-        'NAME_TYPE_SUITE': 'object', 'NAME_INCOME_TYPE': 'object', 'NAME_EDUCATION_TYPE': 'object', 'NAME_FAMILY_STATUS': 'object', 'NAME_HOUSING_TYPE': 'object',
-        'REGION_POPULATION_RELATIVE': 'float64', 'DAYS_BIRTH': 'int64', 'DAYS_EMPLOYED': 'int64', 'DAYS_REGISTRATION': 'float64', 'DAYS_ID_PUBLISH': 'int64',
-        'OWN_CAR_AGE': 'float64', 'FLAG_MOBIL': 'int64', 'FLAG_EMP_PHONE': 'int64', 'FLAG_WORK_PHONE': 'int64', 'FLAG_CONT_MOBILE': 'int64',
-        'FLAG_PHONE': 'int64', 'FLAG_EMAIL': 'int64', 'OCCUPATION_TYPE': 'object', 'CNT_FAM_MEMBERS': 'float64', 'REGION_RATING_CLIENT': 'int64',
-        'REGION_RATING_CLIENT_W_CITY': 'int64', 'WEEKDAY_APPR_PROCESS_START': 'object', 'HOUR_APPR_PROCESS_START': 'int64', 'REG_REGION_NOT_LIVE_REGION': 'int64', 'REG_REGION_NOT_WORK_REGION': 'int64',
-        'LIVE_REGION_NOT_WORK_REGION': 'int64', 'REG_CITY_NOT_LIVE_CITY': 'int64', 'REG_CITY_NOT_WORK_CITY': 'int64', 'LIVE_CITY_NOT_WORK_CITY': 'int64', 'ORGANIZATION_TYPE': 'object',
-        'EXT_SOURCE_1': 'float64', 'EXT_SOURCE_2': 'float64', 'EXT_SOURCE_3': 'float64', 'APARTMENTS_AVG': 'float64', 'BASEMENTAREA_AVG': 'float64',
-        'YEARS_BEGINEXPLUATATION_AVG': 'float64', 'YEARS_BUILD_AVG': 'float64', 'COMMONAREA_AVG': 'float64', 'ELEVATORS_AVG': 'float64', 'ENTRANCES_AVG': 'float64',
-        'FLOORSMAX_AVG': 'float64', 'FLOORSMIN_AVG': 'float64', 'LANDAREA_AVG': 'float64', 'LIVINGAPARTMENTS_AVG': 'float64', 'LIVINGAREA_AVG': 'float64',
-        'NONLIVINGAPARTMENTS_AVG': 'float64', 'NONLIVINGAREA_AVG': 'float64', 'APARTMENTS_MODE': 'float64', 'BASEMENTAREA_MODE': 'float64', 'YEARS_BEGINEXPLUATATION_MODE': 'float64',
-        'YEARS_BUILD_MODE': 'float64', 'COMMONAREA_MODE': 'float64', 'ELEVATORS_MODE': 'float64', 'ENTRANCES_MODE': 'float64', 'FLOORSMAX_MODE': 'float64',
-        'FLOORSMIN_MODE': 'float64', 'LANDAREA_MODE': 'float64', 'LIVINGAPARTMENTS_MODE': 'float64', 'LIVINGAREA_MODE': 'float64', 'NONLIVINGAPARTMENTS_MODE': 'float64',
-        'NONLIVINGAREA_MODE': 'float64', 'APARTMENTS_MEDI': 'float64', 'BASEMENTAREA_MEDI': 'float64', 'YEARS_BEGINEXPLUATATION_MEDI': 'float64', 'YEARS_BUILD_MEDI': 'float64',
-        'COMMONAREA_MEDI': 'float64', 'ELEVATORS_MEDI': 'float64', 'ENTRANCES_MEDI': 'float64', 'FLOORSMAX_MEDI': 'float64', 'FLOORSMIN_MEDI': 'float64',
-        'LANDAREA_MEDI': 'float64', 'LIVINGAPARTMENTS_MEDI': 'float64', 'LIVINGAREA_MEDI': 'float64', 'NONLIVINGAPARTMENTS_MEDI': 'float64', 'NONLIVINGAREA_MEDI': 'float64',
-        'FONDKAPREMONT_MODE': 'float64', 'HOUSETYPE_MODE': 'object', 'TOTALAREA_MODE': 'float64', 'WALLSMATERIAL_MODE': 'object', 'EMERGENCYSTATE_MODE': 'object',
-        'OBS_30_CNT_SOCIAL_CIRCLE': 'float64', 'DEF_30_CNT_SOCIAL_CIRCLE': 'float64', 'OBS_60_CNT_SOCIAL_CIRCLE': 'float64', 'DEF_60_CNT_SOCIAL_CIRCLE': 'float64', 'DAYS_LAST_PHONE_CHANGE': 'float64',
-        'FLAG_DOCUMENT_2': 'int64', 'FLAG_DOCUMENT_3': 'int64', 'FLAG_DOCUMENT_4': 'int64', 'FLAG_DOCUMENT_5': 'int64', 'FLAG_DOCUMENT_6': 'int64',
-        'FLAG_DOCUMENT_7': 'int64', 'FLAG_DOCUMENT_8': 'int64', 'FLAG_DOCUMENT_9': 'int64', 'FLAG_DOCUMENT_10': 'int64', 'FLAG_DOCUMENT_11': 'int64',
-        'FLAG_DOCUMENT_12': 'int64', 'FLAG_DOCUMENT_13': 'int64', 'FLAG_DOCUMENT_14': 'int64', 'FLAG_DOCUMENT_15': 'int64', 'FLAG_DOCUMENT_16': 'int64',
-        'FLAG_DOCUMENT_17': 'int64', 'FLAG_DOCUMENT_18': 'int64', 'FLAG_DOCUMENT_19': 'int64', 'FLAG_DOCUMENT_20': 'int64', 'FLAG_DOCUMENT_21': 'int64',
-        'AMT_REQ_CREDIT_BUREAU_HOUR': 'float64', 'AMT_REQ_CREDIT_BUREAU_DAY': 'float64', 'AMT_REQ_CREDIT_BUREAU_WEEK': 'float64', 'AMT_REQ_CREDIT_BUREAU_MON': 'float64', 'AMT_REQ_CREDIT_BUREAU_QRT': 'float64',
-        'AMT_REQ_CREDIT_BUREAU_YEAR': 'float64'
-    }
-    
-    col_manquantes = [col for col in needed_columns.keys() if col not in df.columns]
-    if len(col_manquantes) > 0:
+    records, version = await score_applicants(applicants, explain, k)
+    with timed("encode"):
+        content = await run_in_threadpool(orjson.dumps, records)
+    return Response(content, media_type="application/json", headers={"X-Model-Version": version})
+
+
+async def stream_predictions(
+    chunks, first_chunk, bundle, explain: str, k: int, output_format: str, resources: ExitStack
+):
+    """
+    Score les blocs du fichier un par un et renvoie les résultats de chaque bloc dès qu'ils
+    sont prêts, pendant que le bloc suivant est lu et validé dans un autre thread.
+    Une erreur de validation ou de scoring d'un bloc est renvoyée avec ses numéros de lignes
+    et n'interrompt pas le flux. resources (place dans le pool, fichier) est libéré à la fin.
+    """
+    next_chunk = None
+    try:
+        chunk = first_chunk
+        header = True
+        while chunk is not None:
+            # Lire et valider le bloc suivant pendant le scoring du bloc courant
+            next_chunk = asyncio.ensure_future(run_in_threadpool(next, chunks, None))
+
+            if chunk.error is not None:
+                CHUNK_ERRORS.labels(str(chunk.error.status_code)).inc()
+                yield stream_error(
+                    output_format, chunk.row_start, chunk.row_end, chunk.error.status_code, chunk.error.detail
+                )
+            else:
+                try:
+                    results_df, _, _ = await scoring_pool.predict(
+                        chunk.df, SEUIL_DEFAUT, bundle, explain=explain, k=k
+                    )
+                except Exception as e:
+                    CHUNK_ERRORS.labels("500").inc()
+                    yield stream_error(
+                        output_format, chunk.row_start, chunk.row_end, 500, f"Erreur lors du scoring: {e}"
+                    )
+                else:
+                    if output_format == "csv":
+                        yield await run_in_threadpool(to_csv_rows, results_df, header)
+                        header = False
+                    else:
+                        yield await run_in_threadpool(to_ndjson, results_df)
+
+            chunk = await next_chunk
+    finally:
+        # Attendre la lecture en cours (client déconnecté) avant de fermer le fichier
+        if next_chunk is not None and not next_chunk.done():
+            await asyncio.wait([next_chunk])
+        resources.close()
+
+
+# Définir le endpoint POST sur la route "/predict/stream"
+@app.post("/predict/stream", dependencies=[Depends(require_ready)])
+async def predict_stream_endpoint(
+    request: Request,
+    file: UploadFile = File(...),
+    explain: Literal["none", "topk", "full"] = Query("full"),
+    k: int = Query(10, ge=1),
+):
+    """
+    Endpoint de prédiction en flux pour les fichiers volumineux, sans limite de lignes
+    Le fichier est lu, validé et scoré par blocs de STREAM_CHUNK_ROWS lignes : la mémoire
+    utilisée ne dépend pas de la taille du fichier.
+    Paramètres:
+        file: Fichier CSV ou Parquet (.parquet) contenant les données clients
+        explain, k: Voir /predict
+    Retourne: Flux NDJSON (une ligne par client, par défaut) ou CSV (Accept: text/csv). Un bloc
+        invalide produit une ligne d'erreur avec ses numéros de lignes (row_start inclus,
+        row_end exclu, à partir de 0) : objet JSON avec "detail" en NDJSON, ligne commençant
+        par "#" en CSV. La version du modèle utilisée est indiquée dans l'en-tête X-Model-Version
+    """
+
+    # Vérifier l'extension du fichier
+    extension = os.path.splitext(file.filename.lower())[1]
+    if extension not in CHUNK_READERS:
         raise HTTPException(
-            status_code=400,
-            detail=f"Le fichier ne contient pas toutes les colonnes nécessaires. Colonnes manquantes: {col_manquantes}"
+            status_code=422,
+            detail=f"Format de fichier non supporté ({file.filename}). Veuillez fournir un fichier CSV ou Parquet."
         )
-    
-    # Vérifier que le fichier contient au moins l'ID
-    if df['SK_ID_CURR'].isna().sum() > 0:
+
+    with ExitStack() as resources:
+        # Réserver une place dans le pool pour toute la durée du flux
+        resources.enter_context(scoring_pool.admission())
+
+        # FastAPI ferme les fichiers uploadés dès le retour de l'endpoint, avant l'envoi du flux :
+        # reprendre le fichier pour qu'il reste ouvert jusqu'à la fin du flux
+        source, file.file = file.file, io.BytesIO()
+        resources.callback(source.close)
+
+        # Lire le premier bloc avant de répondre : un fichier vide ou incomplet est rejeté en entier
+        chunks = iter_validated_chunks(CHUNK_READERS[extension](source, STREAM_CHUNK_ROWS))
+        try:
+            first_chunk = await run_in_threadpool(next, chunks, None)
+        except SchemaError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+        # Le flux libère la place et ferme le fichier une fois terminé
+        resources = resources.pop_all()
+
+    # Scorer tous les blocs avec la même version du modèle
+    bundle = scoring_pool.current()
+    output_format = negotiate_stream_format(request.headers.get("accept"))
+    return StreamingResponse(
+        stream_predictions(chunks, first_chunk, bundle, explain, k, output_format, resources),
+        media_type=CSV_MEDIA_TYPE if output_format == "csv" else NDJSON_MEDIA_TYPE,
+        headers={"X-Model-Version": bundle.version},
+    )
+
+
+# Définir le endpoint POST sur la route "/jobs"
+@app.post("/jobs", status_code=202, dependencies=[Depends(require_ready)])
+async def create_job_endpoint(
+    file: UploadFile = File(...),
+    explain: Literal["none", "topk", "full"] = Query("full"),
+    k: int = Query(10, ge=1),
+):
+    """
+    Crée une tâche de scoring en arrière-plan pour un fichier volumineux, sans limite de lignes
+    Paramètres:
+        file: Fichier CSV ou Parquet (.parquet) contenant les données clients
+        explain, k: Voir /predict
+    Retourne: Dict: Identifiant et état de la tâche, à suivre sur GET /jobs/{job_id}
+    """
+
+    # Vérifier l'extension du fichier
+    if os.path.splitext(file.filename.lower())[1] not in CHUNK_READERS:
         raise HTTPException(
-            status_code=400,
-            detail=f"Le fichier contient {df['SK_ID_CURR'].isna().sum()} ligne(s) avec des valeurs manquantes dans la colonne SK_ID_CURR. Toutes les lignes doivent avoir un identifiant client."
+            status_code=422,
+            detail=f"Format de fichier non supporté ({file.filename}). Veuillez fournir un fichier CSV ou Parquet."
         )
-    
-    # Vérifier les types des colonnes
+
+    # Copier le fichier sur disque pour qu'il survive à un redémarrage de l'API
     try:
-        df = df.astype(needed_columns)
-    except (ValueError, TypeError) as e:
-        # Trouver les colonnes pour lesquelles la conversion a échouée
-        failed_columns = []
-        for col, dtype in needed_columns.items():
-            if col in df.columns:
-                try:
-                    df[col].astype(dtype)
-                except (ValueError, TypeError):
-                    failed_columns.append({
-                        'column': col,
-                        'expected_type': dtype,
-                        'current_type': str(df[col].dtype)
-                    })
-        
-        error_msg = "Impossible de convertir les types de données pour les colonnes: "
-        error_msg += ", ".join([f"{fc['column']} (attendu: {fc['expected_type']}, trouvé: {fc['current_type']})" 
-                                for fc in failed_columns])
-        
-        raise HTTPException(
-            status_code=400,
-            detail=error_msg
+        job_id = await run_in_threadpool(
+            job_store.create, file.filename, file.file, explain, k, SEUIL_DEFAUT
         )
-    
-    # Effectuer la prédiction
-    results_df = predict(df, 0.48)
+    except SchemaError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    job_runner.submit(job_id)
+    return {"job_id": job_id, "status": "queued"}
+
+
+def get_job_or_404(job_id: str) -> dict:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Tâche inconnue: {job_id}")
+    return job
+
+
+# Définir le endpoint GET sur la route "/jobs/{job_id}"
+@app.get("/jobs/{job_id}")
+def get_job_endpoint(job_id: str):
+    """
+    Endpoint de suivi d'une tâche de scoring
+    Paramètre: job_id: Identifiant retourné par POST /jobs
+    Retourne: Dict: État (queued, running, done ou failed), lignes du fichier (rows_total, dès la création),
+        lignes scorées et en erreur, avancement (progress, de 0 à 1), débit (lignes par seconde) et
+        erreurs des blocs invalides avec leurs numéros de lignes
+    """
+    job = get_job_or_404(job_id)
+    job.pop("input_path")
+    job["job_id"] = job.pop("id")
+    return job
+
+
+# Définir le endpoint GET sur la route "/jobs/{job_id}/results"
+@app.get("/jobs/{job_id}/results")
+def get_job_results_endpoint(
+    request: Request,
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=100000),
+):
+    """
+    Endpoint de lecture d'une plage de résultats d'une tâche, disponible pendant son exécution
+    Paramètres:
+        job_id: Identifiant retourné par POST /jobs
+        offset: Position de la première ligne de résultats retournée
+        limit: Nombre maximal de lignes retournées
+    Retourne: List[Dict]: Résultats au format de /predict, ou un flux Arrow IPC / un fichier Parquet
+        selon l'en-tête Accept. L'en-tête X-Rows-Available indique le nombre de lignes de résultats
+        disponibles (les blocs en erreur ne produisent pas de lignes)
+    """
+    job = get_job_or_404(job_id)
+    results_df, available = job_store.read_results(job_id, offset, limit)
+    headers = {"X-Rows-Available": str(available), "X-Model-Version": job["model_version"] or ""}
+
+    output_format = negotiate_format(request.headers.get("accept"))
+    if output_format == "arrow":
+        return Response(to_arrow_ipc(results_df), media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+    if output_format == "parquet":
+        return Response(to_parquet(results_df), media_type=PARQUET_MEDIA_TYPES[0], headers=headers)
+    return Response(to_json_records(results_df), media_type="application/json", headers=headers)
+
 
-    # Retourner les résultats sous forme de dictionnaire pour
-    # conversion automatique par FastAPI en format JSON
-    return results_df.reset_index().to_dict(orient="records")
+# Définir le endpoint GET sur la route "/health/live"
+@app.get("/health/live")
+def liveness_endpoint():
+    """
+    Sonde de vivacité : répond dès le lancement du processus, pendant le chargement du modèle
+    Retourne: Dict: État du démarrage, ou 503 si le démarrage a échoué (l'API doit être redémarrée)
+    """
+    if startup_state["status"] == "failed":
+        return JSONResponse(
+            status_code=503, content={"status": "failed", "detail": startup_state["detail"]}
+        )
+    return {"status": startup_state["status"]}
+
+
+# Définir le endpoint GET sur la route "/health/ready"
+@app.get("/health/ready")
+def readiness_endpoint():
+    """
+    Sonde de disponibilité : le trafic ne doit être envoyé qu'aux APIs prêtes
+    Retourne: Dict: Version du modèle servi et durées du démarrage et du préchauffage (s),
+        ou 503 pendant le chargement, après un échec du démarrage et pendant l'arrêt
+    """
+    if startup_state["status"] != "ready":
+        return JSONResponse(status_code=503, content=startup_state)
+    return {**startup_state, "model_version": scoring_pool.current().version}
+
+
+# Définir le endpoint GET sur la route "/metrics"
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Endpoint des métriques au format Prometheus
+    Retourne: Durées des étapes (upload, read_file, validate, cache_lookup, model_load, warmup, pool_wait,
+        preprocess, predict, shap_values, shap_grouping, encode), durée et codes HTTP des réponses
+        par endpoint, taille des lots, nombre de lignes scorées, blocs en erreur, pic de mémoire des lots
+        (avec MEMORY_PROFILE=1) et lots comparés aux versions challengers (étapes challenger_preprocess
+        et challenger_predict)
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+# Définir le endpoint GET sur la route "/batching"
+@app.get("/batching")
+async def batching_endpoint():
+    """
+    Retourne la configuration du regroupement des requêtes et les statistiques de remplissage des lots
+    """
+    return batcher.stats()
+
+# Définir le endpoint GET sur la route "/cache"
+@app.get("/cache")
+async def cache_endpoint():
+    """
+    Retourne la configuration et les compteurs du cache de prédictions (succès, échecs, évictions)
+    """
+    return cache.stats()
+
+# Définir le endpoint GET sur la route "/challengers"
+@app.get("/challengers")
+async def challengers_endpoint():
+    """
+    Retourne les versions challengers comparées au modèle servi et les compteurs de lots
+    (scorés, abandonnés car la file était pleine, en erreur) et de fichiers de résultats écrits
+    """
+    return challengers.stats()
 
 # Lancer l'API
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+import io
+import os
+from typing import Callable
+
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Types MIME des formats de réponse colonnaires
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPES = ("application/vnd.apache.parquet", "application/x-parquet")
+
+# Types MIME des formats de réponse en flux
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+
+def write_atomic(path: str, write: Callable[[str], None]) -> None:
+    """
+    Écrit un fichier avec write(chemin) dans un fichier temporaire renommé ensuite en path,
+    pour ne jamais laisser de fichier partiel.
+    """
+    write(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def negotiate_format(accept: str) -> str:
+    """
+    Choisit le format de réponse à partir de l'en-tête Accept.
+
+    Paramètre: accept: Valeur de l'en-tête Accept de la requête (éventuellement vide)
+    Retourne: str: "arrow", "parquet" ou "json" (par défaut)
+    """
+    for media_range in (accept or "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type == ARROW_STREAM_MEDIA_TYPE:
+            return "arrow"
+        if media_type in PARQUET_MEDIA_TYPES:
+            return "parquet"
+    return "json"
+
+
+def negotiate_stream_format(accept: str) -> str:
+    """
+    Choisit le format d'une réponse en flux à partir de l'en-tête Accept.
+
+    Paramètre: accept: Valeur de l'en-tête Accept de la requête (éventuellement vide)
+    Retourne: str: "csv" ou "ndjson" (par défaut)
+    """
+    for media_range in (accept or "").split(","):
+        if media_range.split(";")[0].strip().lower() == CSV_MEDIA_TYPE:
+            return "csv"
+    return "ndjson"
+
+
+def to_json_records(results_df: pd.DataFrame) -> bytes:
+    """
+    Sérialise les résultats en JSON, une entrée par client (format historique de /predict).
+    Évite le parcours de jsonable_encoder en encodant directement avec orjson.
+    """
+    return orjson.dumps(results_df.reset_index().to_dict(orient="records"))
+
+
+def to_json_columnar(results_df: pd.DataFrame, explain: str) -> bytes:
+    """
+    Sérialise les résultats en JSON colonnaire, directement depuis les tableaux numpy.
+
+    Paramètres:
+        results_df: Résultats retournés par utilities.predict
+        explain: Mode d'explication utilisé pour produire results_df
+
+    Retourne:
+        JSON contenant SK_ID_CURR, PROBA_DEFAUT et PRED_DEFAUT sous forme de listes, puis
+        selon le mode : "features" et la matrice "shap" (full), ou les matrices "variables"
+        et "shap" des k plus fortes contributions (topk)
+    """
+    payload = {
+        "SK_ID_CURR": results_df.index.to_numpy(),
+        "PROBA_DEFAUT": results_df["PROBA_DEFAUT"].to_numpy(),
+        "PRED_DEFAUT": results_df["PRED_DEFAUT"].to_numpy(),
+    }
+    if explain == "full":
+        shap_df = results_df.iloc[:, 2:]
+        payload["features"] = list(shap_df.columns)
+        payload["shap"] = np.ascontiguousarray(shap_df.to_numpy(dtype=np.float64))
+    elif explain == "topk":
+        payload["variables"] = results_df.filter(regex=r"^VARIABLE_").to_numpy().tolist()
+        payload["shap"] = np.ascontiguousarray(
+            results_df.filter(regex=r"^SHAP_").to_numpy(dtype=np.float64)
+        )
+    return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def results_to_table(results_df: pd.DataFrame) -> pa.Table:
+    """
+    Convertit les résultats en table Arrow, l'index SK_ID_CURR devenant la première colonne.
+    """
+    return pa.Table.from_pandas(results_df.reset_index(), preserve_index=False)
+
+
+def to_arrow_ipc(results_df: pd.DataFrame) -> bytes:
+    """
+    Sérialise les résultats au format Arrow IPC (flux).
+    """
+    table = results_to_table(results_df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_parquet(results_df: pd.DataFrame) -> bytes:
+    """
+    Sérialise les résultats au format Parquet.
+    """
+    buffer = io.BytesIO()
+    pq.write_table(results_to_table(results_df), buffer)
+    return buffer.getvalue()
+
+
+def to_ndjson(results_df: pd.DataFrame) -> bytes:
+    """
+    Sérialise les résultats en NDJSON : une ligne JSON par client, avec les clés de /predict.
+    """
+    records = results_df.reset_index().to_dict(orient="records")
+    return b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records)
+
+
+def to_csv_rows(results_df: pd.DataFrame, header: bool) -> bytes:
+    """
+    Sérialise les résultats en lignes CSV, précédées de l'entête si header est vrai.
+    """
+    return results_df.to_csv(header=header).encode("utf-8")
+
+
+def stream_error(output_format: str, row_start: int, row_end: int, status_code: int, detail: str) -> bytes:
+    """
+    Sérialise l'erreur d'un bloc de lignes dans un flux de résultats : une ligne JSON
+    {"detail", "status_code", "row_start", "row_end"} en NDJSON, une ligne de commentaire
+    commençant par "#" en CSV.
+    """
+    if output_format == "csv":
+        detail = " ".join(detail.splitlines())
+        return f"# Erreur {status_code} lignes {row_start} à {row_end}: {detail}\n".encode("utf-8")
+    return orjson.dumps(
+        {"detail": detail, "status_code": status_code, "row_start": row_start, "row_end": row_end},
+        option=orjson.OPT_APPEND_NEWLINE,
+    )
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import sys
+import time
+from functools import partial
+from typing import Any, Dict, List
+
+import joblib
+import pandas as pd
+from scipy import sparse
+
+from model_registry import (
+    MODEL_NAME,
+    ModelBundle,
+    ModelRegistry,
+    build_bundle,
+    load_bundle,
+    resolve_latest_version,
+)
+from schema import SCHEMA
+from serialization import write_atomic
+
+# Fichiers d'un instantané ; metadata.json est écrit en dernier et marque un instantané complet
+PIPELINE_FILE = "pipeline.joblib"
+AGGREGATION_FILE = "aggregation_matrix.npz"
+WARMUP_FILE = "warmup.parquet"
+METADATA_FILE = "metadata.json"
+
+# Clients utilisés par défaut pour la passe de préchauffage
+DEFAULT_WARMUP_SOURCE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fichiers tests", "application_test_2_clients.csv"
+)
+
+
+def read_clients_file(path: str, max_rows: int = None) -> pd.DataFrame:
+    """
+    Lit et valide un fichier CSV ou Parquet de clients avec le schéma de l'API.
+
+    Paramètres:
+        path: Fichier CSV ou Parquet des données clients
+        max_rows: Nombre de lignes conservées (optionnel, toutes par défaut)
+
+    Retourne:
+        pd.DataFrame: Données clients aux types attendus par le modèle
+    """
+    reader = SCHEMA.read_parquet if path.lower().endswith(".parquet") else SCHEMA.read_csv
+    with open(path, "rb") as source:
+        df = reader(source)
+    if max_rows is not None:
+        df = df.head(max_rows)
+    return SCHEMA.validate(df)
+
+
+def save_snapshot(
+    bundle: ModelBundle, path: str, model_name: str = MODEL_NAME, warmup_df: pd.DataFrame = None
+) -> None:
+    """
+    Enregistre dans un répertoire local le pipeline d'une version du modèle, les métadonnées
+    de ses variables et des clients de préchauffage, pour démarrer l'API sans registre MLflow.
+
+    Paramètres:
+        bundle: Modèle chargé depuis le registre
+        path: Répertoire de l'instantané
+        model_name: Nom du modèle dans le registre MLflow
+        warmup_df: Clients scorés au démarrage avant que l'API ne se déclare prête (optionnel)
+    """
+    os.makedirs(path, exist_ok=True)
+    write_atomic(os.path.join(path, PIPELINE_FILE), lambda p: joblib.dump(bundle.pipe, p))
+
+    def write_aggregation(p: str) -> None:
+        # Passer un fichier ouvert : save_npz ajoute l'extension .npz aux noms qui ne la contiennent pas
+        with open(p, "wb") as f:
+            sparse.save_npz(f, bundle.aggregation_matrix)
+
+    write_atomic(os.path.join(path, AGGREGATION_FILE), write_aggregation)
+    if warmup_df is not None:
+        write_atomic(os.path.join(path, WARMUP_FILE), lambda p: warmup_df.to_parquet(p, index=False))
+    elif os.path.exists(os.path.join(path, WARMUP_FILE)):
+        os.remove(os.path.join(path, WARMUP_FILE))
+
+    metadata = {
+        "model_name": model_name,
+        "version": bundle.version,
+        "created_at": time.time(),
+        "original_features": bundle.original_features,
+        "transformed_features": bundle.transformed_features,
+        "feature_mapping": bundle.feature_mapping,
+        "grouped_features": bundle.grouped_features,
+        # Conserver l'empreinte calculée sur le pipeline du registre : celle du pipeline relu
+        # depuis joblib peut différer et empêcherait le partage avec les versions challengers
+        "preprocessing_key": bundle.preprocessing_key,
+    }
+
+    def write_metadata(p: str) -> None:
+        with open(p, "w") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+
+    write_atomic(os.path.join(path, METADATA_FILE), write_metadata)
+
+
+def read_metadata(path: str) -> Dict[str, Any]:
+    """
+    Retourne les métadonnées d'un instantané. Lève FileNotFoundError si l'instantané est incomplet.
+    """
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def snapshot_version(path: str, model_name: str = MODEL_NAME) -> str:
+    """
+    Retourne la version du modèle contenue dans l'instantané, sans accès au registre MLflow.
+    """
+    metadata = read_metadata(path)
+    if metadata["model_name"] != model_name:
+        raise ValueError(
+            f"L'instantané {path} contient le modèle {metadata['model_name']} et non {model_name}"
+        )
+    return metadata["version"]
+
+
+def load_snapshot(path: str, version: str = None, model_name: str = MODEL_NAME) -> ModelBundle:
+    """
+    Charge le pipeline et les métadonnées précalculées d'un instantané et construit son ModelBundle.
+    Signature compatible avec le chargeur de ModelRegistry une fois path fixé (functools.partial).
+    """
+    metadata = read_metadata(path)
+    if version is not None and str(version) != metadata["version"]:
+        raise ValueError(
+            f"L'instantané {path} contient la version {metadata['version']} et non {version}"
+        )
+
+    pipe = joblib.load(os.path.join(path, PIPELINE_FILE))
+    features = {
+        name: metadata[name]
+        for name in ("original_features", "transformed_features", "feature_mapping", "grouped_features")
+    }
+    features["aggregation_matrix"] = sparse.load_npz(os.path.join(path, AGGREGATION_FILE)).tocsr()
+    return build_bundle(pipe, metadata["version"], features, metadata.get("preprocessing_key"))
+
+
+def read_warmup_frame(path: str) -> pd.DataFrame:
+    """
+    Retourne les clients de préchauffage de l'instantané, None s'il n'en contient pas.
+    """
+    warmup_path = os.path.join(path, WARMUP_FILE)
+    if not os.path.exists(warmup_path):
+        return None
+    return read_clients_file(warmup_path)
+
+
+def snapshot_registry(path: str, model_name: str = MODEL_NAME) -> ModelRegistry:
+    """
+    Retourne un registre servant le modèle de l'instantané, sans MLflow ni surveillance de nouvelles versions.
+    Le chargeur est picklable pour être transmis aux processus de scoring.
+    """
+    return ModelRegistry(
+        model_name,
+        poll_interval=0,
+        loader=partial(load_snapshot, path),
+        resolver=partial(snapshot_version, path),
+    )
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Enregistre un instantané local du modèle pour démarrer l'API sans registre MLflow."
+    )
+    parser.add_argument("output_dir", help="Répertoire de l'instantané (variable MODEL_SNAPSHOT de l'API)")
+    parser.add_argument("--model-version", help="Version du modèle (par défaut la dernière version enregistrée)")
+    parser.add_argument("--model-name", default=MODEL_NAME, help="Nom du modèle dans le registre MLflow")
+    parser.add_argument("--tracking-uri", help="Registre MLflow (par défaut MLFLOW_TRACKING_URI)")
+    parser.add_argument(
+        "--warmup-file", default=DEFAULT_WARMUP_SOURCE, help="Fichier CSV ou Parquet des clients de préchauffage"
+    )
+    parser.add_argument("--warmup-rows", type=int, default=10, help="Nombre de clients de préchauffage")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    if args.tracking_uri:
+        os.environ["MLFLOW_TRACKING_URI"] = args.tracking_uri
+
+    # Lire les clients de préchauffage avant le chargement du modèle pour échouer rapidement
+    warmup_df = None
+    if args.warmup_file and args.warmup_rows > 0:
+        try:
+            warmup_df = read_clients_file(args.warmup_file, args.warmup_rows)
+        except (OSError, ValueError) as e:
+            print(f"Erreur: {e}", file=sys.stderr)
+            return 2
+
+    version = args.model_version or resolve_latest_version(args.model_name)
+    bundle = load_bundle(version, args.model_name)
+    save_snapshot(bundle, args.output_dir, args.model_name, warmup_df)
+    print(
+        f"Instantané du modèle {args.model_name} version {bundle.version} enregistré dans {args.output_dir} "
+        f"({len(bundle.original_features)} variables, "
+        f"{0 if warmup_df is None else len(warmup_df)} clients de préchauffage)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
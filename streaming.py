@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from schema import SCHEMA, CompiledSchema, SchemaError
+
+# Lecteurs par blocs des formats de fichier acceptés pour le scoring en flux ou en tâche de fond
+CHUNK_READERS = {
+    ".csv": SCHEMA.iter_csv,
+    ".parquet": SCHEMA.iter_parquet,
+}
+
+
+def count_rows(path: str) -> int:
+    """
+    Compte les lignes de données d'un fichier CSV ou Parquet sans le parser, pour suivre
+    l'avancement de son scoring.
+
+    Paramètre: path: Fichier CSV ou Parquet
+    Retourne: int: Nombre de lignes des métadonnées Parquet, ou nombre de lignes du CSV hors
+        entête (les valeurs entre guillemets contenant des retours à la ligne sont surcomptées)
+    Lève: SchemaError (400) si les métadonnées du fichier Parquet sont illisibles
+    """
+    if path.lower().endswith(".parquet"):
+        try:
+            return pq.ParquetFile(path).metadata.num_rows
+        except (pa.ArrowInvalid, OSError) as e:
+            raise SchemaError(400, f"Lecture du fichier impossible: {e}")
+
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    # Compter la dernière ligne sans retour à la ligne final, puis retirer l'entête
+    if last != b"\n":
+        lines += 1
+    return max(lines - 1, 0)
+
+
+@dataclass
+class Chunk:
+    """
+    Bloc de lignes d'un fichier lu par blocs, avec sa position dans le fichier.
+    row_start (inclus) et row_end (exclu) comptent les lignes de données à partir de 0.
+    Contient soit les données validées (df), soit l'erreur à signaler pour ces lignes.
+    Un bloc en erreur sans ligne (row_start == row_end) signale un fichier illisible à partir de row_start.
+    """
+
+    row_start: int
+    row_end: int
+    df: Optional[pd.DataFrame] = None
+    error: Optional[SchemaError] = None
+
+
+def iter_validated_chunks(
+    chunks: Iterator[pd.DataFrame], schema: CompiledSchema = SCHEMA
+) -> Iterator[Chunk]:
+    """
+    Valide chaque bloc lu indépendamment : un bloc invalide est signalé avec ses numéros
+    de lignes sans interrompre la lecture des blocs suivants.
+
+    Paramètres:
+        chunks: Blocs de données clients (SCHEMA.iter_csv ou SCHEMA.iter_parquet)
+        schema: Schéma utilisé pour la validation
+
+    Retourne:
+        Iterator[Chunk]: Un Chunk par bloc lu
+
+    Lève:
+        SchemaError à la lecture du premier bloc si le fichier est vide ou s'il manque des
+        colonnes, ces erreurs concernant le fichier entier
+    """
+    row_start = 0
+    while True:
+        try:
+            df = next(chunks)
+        except StopIteration:
+            if row_start == 0:
+                raise SchemaError(
+                    400, "Le fichier CSV est vide. Veuillez fournir un fichier contenant des données."
+                )
+            return
+        except (pd.errors.ParserError, pa.ArrowInvalid, OSError, ValueError) as e:
+            # Une ligne mal formée empêche de lire la suite du fichier : signaler la position et s'arrêter
+            yield Chunk(
+                row_start,
+                row_start,
+                error=SchemaError(400, f"Lecture du fichier impossible après la ligne {row_start}: {e}"),
+            )
+            return
+
+        if row_start == 0:
+            schema.check_columns(df.columns)
+
+        row_end = row_start + len(df)
+        try:
+            chunk = Chunk(row_start, row_end, df=schema.validate(df))
+        except SchemaError as e:
+            chunk = Chunk(row_start, row_end, error=e)
+        yield chunk
+        row_start = row_end
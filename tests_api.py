@@ -1,6 +1,17 @@
 import pytest
 import requests
 import logging
+import json
+import time
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
+from schema import SCHEMA
+from utilities import RecordPreprocessor, create_feature_mapping
 
 # Configuration du logging pour pytest
 logging.basicConfig(level=logging.INFO, format='%(message)s')
@@ -198,4 +209,374 @@ def test_sans_fichier():
     logger.info(f"Status détail: {response.json()['detail']}")
 
     # Assert pour validation pytest
-    assert response.status_code == 422, f"Attendu 422, reçu {response.status_code}"
\ No newline at end of file
+    assert response.status_code == 422, f"Attendu 422, reçu {response.status_code}"
+
+############################################ 10. Test version du modèle servie ################################################
+
+def test_version_modele():
+    """Test présence de la version du modèle dans la réponse"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict"
+    test_name = "Test version du modèle servie"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Ouvrir le fichier et l'envoyer à l'API et récupérer la réponse
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        response = requests.post(url, files=files)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+    logger.info(f"Version du modèle: {response.headers.get('X-Model-Version')}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    assert response.headers.get('X-Model-Version'), "En-tête X-Model-Version absent"
+
+
+######################################### 11. Test prédiction sans explication SHAP ###########################################
+
+def test_sans_explication():
+    """Test prédiction sans valeurs SHAP"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict?explain=none"
+    test_name = "Test prédiction sans explication SHAP"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Ouvrir le fichier et l'envoyer à l'API et récupérer la réponse
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        response = requests.post(url, files=files)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    assert set(response.json()[0].keys()) == {'SK_ID_CURR', 'PROBA_DEFAUT', 'PRED_DEFAUT'}
+
+########################################## 12. Test prédiction avec les k variables principales ###############################
+
+def test_explication_top_k():
+    """Test prédiction avec les 5 plus fortes contributions SHAP"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict?explain=topk&k=5"
+    test_name = "Test prédiction avec les k variables principales"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Ouvrir le fichier et l'envoyer à l'API et récupérer la réponse
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        response = requests.post(url, files=files)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    resultat = response.json()[0]
+    assert 'VARIABLE_5' in resultat and 'VARIABLE_6' not in resultat
+    assert abs(resultat['SHAP_1']) >= abs(resultat['SHAP_5'])
+
+
+############################################ 13. Test fichier Parquet et réponse Arrow ########################################
+
+def test_fichier_parquet_reponse_arrow():
+    """Test fichier Parquet avec une réponse au format Arrow IPC"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict"
+    test_name = "Test fichier Parquet et réponse Arrow"
+    file_path = "fichiers tests/application_test_2_clients.parquet"
+
+    # Ouvrir le fichier et l'envoyer à l'API en demandant une réponse Arrow
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'application/vnd.apache.parquet')}
+        headers = {'Accept': 'application/vnd.apache.arrow.stream'}
+        response = requests.post(url, files=files, headers=headers)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+    logger.info(f"Content-Type: {response.headers.get('Content-Type')}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    assert response.headers.get('Content-Type') == 'application/vnd.apache.arrow.stream'
+    assert pa.ipc.open_stream(response.content).read_all().column_names[0] == 'SK_ID_CURR'
+
+
+############################################### 14. Test prédiction d'un client en JSON ###############################################
+
+def test_prediction_un_client_json():
+    """Test prédiction à faible latence d'un client envoyé en JSON"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict/one"
+    test_name = "Test prédiction d'un client en JSON"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Lire le premier client du fichier et l'envoyer à l'API en JSON
+    client = json.loads(pd.read_csv(file_path, index_col=0).iloc[[0]].to_json(orient='records'))[0]
+    response = requests.post(url, json=client)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    resultat = response.json()
+    assert resultat['SK_ID_CURR'] == client['SK_ID_CURR']
+    assert 'PROBA_DEFAUT' in resultat and 'PRED_DEFAUT' in resultat
+    assert response.headers.get('X-Model-Version')
+
+
+################################################ 15. Test prédiction en flux (NDJSON) ################################################
+
+def test_prediction_flux_ndjson():
+    """Test prédiction en flux avec une ligne NDJSON par client"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict/stream?explain=none"
+    test_name = "Test prédiction en flux (NDJSON)"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Ouvrir le fichier et l'envoyer à l'API et récupérer la réponse
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        response = requests.post(url, files=files)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    lignes = [json.loads(ligne) for ligne in response.text.splitlines() if ligne]
+    assert len(lignes) == 2
+    assert all('detail' not in ligne and 'PROBA_DEFAUT' in ligne for ligne in lignes)
+
+
+################################################# 16. Test tâche de scoring en arrière-plan ##########################################
+
+def test_tache_scoring():
+    """Test création d'une tâche de scoring, suivi de son avancement et lecture des résultats"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/jobs?explain=none"
+    test_name = "Test tâche de scoring en arrière-plan"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Ouvrir le fichier et l'envoyer à l'API et récupérer l'identifiant de la tâche
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        response = requests.post(url, files=files)
+    assert response.status_code == 202, f"Attendu 202, reçu {response.status_code}"
+    job_id = response.json()['job_id']
+
+    # Attendre la fin de la tâche
+    for _ in range(60):
+        tache = requests.get(f"http://localhost:8000/jobs/{job_id}").json()
+        if tache['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.5)
+
+    # Lire les résultats
+    response = requests.get(f"http://localhost:8000/jobs/{job_id}/results?offset=1&limit=10")
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Statut de la tâche: {tache['status']}")
+
+    # Assert pour validation pytest
+    assert tache['status'] == 'done' and tache['rows_done'] == 2
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    assert response.headers.get('X-Rows-Available') == '2'
+    assert len(response.json()) == 1
+
+
+##################################################### 17. Test métriques Prometheus #####################################################
+
+def test_metriques_prometheus():
+    """Test exposition des métriques après une prédiction"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict"
+    test_name = "Test métriques Prometheus"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Effectuer une prédiction puis récupérer les métriques
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        requests.post(url, files=files)
+    response = requests.get("http://localhost:8000/metrics")
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+
+    # Assert pour validation pytest
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    assert 'defaut_credit_stage_seconds_bucket{le="0.01",stage="read_file"}' in response.text
+    assert 'defaut_credit_responses_total{endpoint="/predict",status_code="200"}' in response.text
+
+
+##################################################### 18. Test sondes de santé #####################################################
+
+def test_sondes_sante():
+    """Test sondes de vivacité et de disponibilité d'une API démarrée"""
+    # Définir le nom du test
+    test_name = "Test sondes de santé"
+
+    # Interroger les deux sondes
+    live = requests.get("http://localhost:8000/health/live")
+    ready = requests.get("http://localhost:8000/health/ready")
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Vivacité: {live.status_code}, disponibilité: {ready.status_code}")
+
+    # Assert pour validation pytest
+    assert live.status_code == 200, f"Attendu 200, reçu {live.status_code}"
+    assert ready.status_code == 200, f"Attendu 200, reçu {ready.status_code}"
+    assert ready.json()['status'] == 'ready' and ready.json()['model_version']
+
+
+##################################################### 19. Test champion / challengers #####################################################
+
+def test_challengers():
+    """Test statistiques des versions challengers après une prédiction"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict"
+    test_name = "Test champion / challengers"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Effectuer une prédiction puis récupérer les statistiques des challengers
+    with open(file_path, 'rb') as f:
+        files = {'file': (file_path, f, 'text/csv')}
+        prediction = requests.post(url, files=files)
+    response = requests.get("http://localhost:8000/challengers")
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+
+    # Assert pour validation pytest : la réponse ne dépend pas des challengers
+    assert prediction.status_code == 200, f"Attendu 200, reçu {prediction.status_code}"
+    assert response.status_code == 200, f"Attendu 200, reçu {response.status_code}"
+    stats = response.json()
+    assert stats['enabled'] == (len(stats['versions']) > 0)
+    assert {'versions', 'scored', 'dropped', 'failed', 'pending'} <= stats.keys()
+
+
+############################################ 20. Test mapping des variables à préfixe commun ############################################
+
+def test_mapping_variables_prefixe_commun():
+    """Test rattachement des colonnes one-hot à leur propre variable quand un nom en préfixe un autre"""
+    # Définir le nom du test et des variables dont le nom est le préfixe d'une autre
+    test_name = "Test mapping des variables à préfixe commun"
+    original_features = [
+        'FLAG_DOCUMENT_2', 'FLAG_DOCUMENT_21', 'REGION_RATING_CLIENT', 'REGION_RATING_CLIENT_W_CITY'
+    ]
+    transformed_features = [
+        'FLAG_DOCUMENT_2_0', 'FLAG_DOCUMENT_2_1', 'FLAG_DOCUMENT_21_0', 'FLAG_DOCUMENT_21_1',
+        'REGION_RATING_CLIENT_1', 'REGION_RATING_CLIENT_2',
+        'REGION_RATING_CLIENT_W_CITY_1', 'REGION_RATING_CLIENT_W_CITY_2', 'REGION_RATING_CLIENT_W_CITY_3',
+    ]
+
+    # Construire le mapping des variables transformées vers les variables originales
+    mapping = create_feature_mapping(original_features, transformed_features)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Mapping: {mapping}")
+
+    # Assert pour validation pytest : chaque colonne one-hot est rattachée à sa propre variable
+    assert mapping['FLAG_DOCUMENT_2'] == [0, 1]
+    assert mapping['FLAG_DOCUMENT_21'] == [2, 3]
+    assert mapping['REGION_RATING_CLIENT'] == [4, 5]
+    assert mapping['REGION_RATING_CLIENT_W_CITY'] == [6, 7, 8]
+
+
+############################################ 21. Test prétraitement précalculé du chemin à faible latence ############################################
+
+def test_pretraitement_precalcule():
+    """Test prétraitement précalculé de /predict/one et /predict/json identique à celui du pipeline"""
+    # Définir le nom du test et ajuster un prétraitement de même forme que celui du modèle
+    test_name = "Test prétraitement précalculé du chemin à faible latence"
+    df = SCHEMA.validate(pd.read_csv("fichiers tests/application_test_2_clients.csv", index_col=0))
+    numeric_columns = [col for col in SCHEMA.numeric_columns if col != 'SK_ID_CURR']
+    text_columns = [col for col in SCHEMA.object_columns if col != 'ORGANIZATION_TYPE']
+    ct = ColumnTransformer([
+        ('num', SimpleImputer(strategy='median'), numeric_columns),
+        ('ohe', make_pipeline(SimpleImputer(strategy='most_frequent'), OneHotEncoder(handle_unknown='ignore')), text_columns),
+        ('te', OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1, encoded_missing_value=-2), ['ORGANIZATION_TYPE']),
+    ], sparse_threshold=0)
+    preprocessor = make_pipeline(ct).fit(df)
+
+    # Clients avec des valeurs manquantes et des catégories inconnues à l'entraînement
+    clients = pd.concat([df, df], ignore_index=True)
+    clients.loc[0, text_columns] = np.nan
+    clients.loc[1, 'ORGANIZATION_TYPE'] = np.nan
+    clients.loc[2, text_columns + ['ORGANIZATION_TYPE']] = 'Inconnue'
+    clients.loc[3, numeric_columns[:10]] = np.nan
+
+    # Transformer avec le pipeline et avec le prétraitement précalculé (deux fois pour le cache)
+    record_preprocessor = RecordPreprocessor(preprocessor, SCHEMA.object_columns)
+    expected = preprocessor.transform(clients)
+    results = [record_preprocessor.transform(clients) for _ in range(2)]
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Matrice transformée: {expected.shape}")
+
+    # Assert pour validation pytest : mêmes valeurs, au bit près, que le pipeline
+    for result in results:
+        assert result.shape == expected.shape
+        assert np.array_equal(result, expected, equal_nan=True)
+
+
+############################################ 22. Test fichier Parquet tronqué ############################################
+
+def test_fichier_parquet_tronque():
+    """Test fichier Parquet tronqué (illisible)"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict"
+    test_name = "Test fichier Parquet tronqué"
+    file_path = "fichiers tests/application_test_2_clients.parquet"
+
+    # Ne garder que la première moitié du fichier et l'envoyer à l'API
+    with open(file_path, 'rb') as f:
+        contenu = f.read()
+    files = {'file': ("application_test_tronque.parquet", contenu[:len(contenu) // 2], 'application/vnd.apache.parquet')}
+    response = requests.post(url, files=files)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+    logger.info(f"Status détail: {response.json()['detail']}")
+
+    # Assert pour validation pytest : le fichier est rejeté comme une erreur du client
+    assert response.status_code == 400, f"Attendu 400, reçu {response.status_code}"
+
+
+############################################ 23. Test booléen dans une colonne numérique en JSON ############################################
+
+def test_json_booleen_colonne_numerique():
+    """Test client JSON avec un booléen dans une colonne numérique, refusé comme dans un fichier"""
+    # Définir l'url, le nom du test et le lien du fichier à utiliser
+    url = "http://localhost:8000/predict/one"
+    test_name = "Test booléen dans une colonne numérique en JSON"
+    file_path = "fichiers tests/application_test_2_clients.csv"
+
+    # Lire le premier client du fichier et remplacer une valeur décimale par un booléen
+    client = json.loads(pd.read_csv(file_path, index_col=0).iloc[[0]].to_json(orient='records'))[0]
+    client['EXT_SOURCE_2'] = True
+    response = requests.post(url, json=client)
+
+    # Enregistrer les détails du test
+    logger.info(test_name)
+    logger.info(f"Status code: {response.status_code}")
+    logger.info(f"Status détail: {response.json()['detail']}")
+
+    # Assert pour validation pytest : la valeur n'est pas convertie en 1.0
+    assert response.status_code == 422, f"Attendu 422, reçu {response.status_code}"
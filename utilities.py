@@ -1,13 +1,30 @@
+import json
+import threading
 import pandas as pd
 import numpy as np
-from typing import List, Dict
-from sklearn.preprocessing import FunctionTransformer, OrdinalEncoder, OneHotEncoder
-from sklearn.impute import SimpleImputer
+from scipy import sparse
+from typing import List, Dict, Tuple, Union
 from sklearn.compose import ColumnTransformer
-from category_encoders import TargetEncoder
-from lightgbm import LGBMClassifier
-import shap
-import mlflow
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+from metrics import span
+
+# Modes d'explication disponibles pour predict
+EXPLAIN_MODES = ("none", "topk", "full")
+
+# Seuil de probabilité au-delà duquel un client est prédit en défaut
+SEUIL_DEFAUT = 0.48
+
+# Colonne de la ligne de produit, dont chaque valeur peut avoir son propre seuil
+PRODUCT_COLUMN = "NAME_CONTRACT_TYPE"
+
+# Matrices transformées float32 du mode économe de predict, réutilisées d'un lot à l'autre par chaque thread
+_buffers = threading.local()
+
+# Clé des valeurs manquantes dans le cache de RecordPreprocessor (NaN n'est pas égal à lui-même)
+_NAN_KEY = object()
 
 
 def get_feature_names_from_column_transformer(
@@ -25,6 +42,9 @@ def get_feature_names_from_column_transformer(
     """
     feature_names = []
     for name, transformer, columns in ct.transformers_:
+        if transformer == "drop":
+            # Les colonnes supprimées ne produisent aucune variable transformée
+            continue
         if name == "remainder":
             # Gérer les colonnes du remainder (passthrough)
             if transformer == "passthrough":
@@ -53,6 +73,10 @@ def create_feature_mapping(
     """
     Crée un mapping entre variables originales et leurs indices dans les variables transformées.
 
+    Une variable transformée est rattachée à la variable originale de même nom, ou à défaut
+    à la plus longue variable originale dont le nom suivi de "_" en est un préfixe (colonnes
+    issues d'un OneHotEncoder). FLAG_DOCUMENT_21 n'est ainsi pas rattachée à FLAG_DOCUMENT_2.
+
     Paramètres:
         original_features: Liste des noms des variables originales
         transformed_features: Liste des noms des variables transformées
@@ -60,97 +84,591 @@ def create_feature_mapping(
     Retourne:
         Dictionnaire mappant chaque variable originale à ses indices transformés
     """
-    mapping = {}
-    for orig_feature in original_features:
-        # Trouver toutes les colonnes transformées qui correspondent à cette variable
-        matching_cols = []
-        for i, trans_feature in enumerate(transformed_features):
-            # Convertir trans_feature en string pour éviter l'erreur TypeError
-            trans_feature_str = str(trans_feature)
-            # Adapter les patterns selon votre encodage
-            if orig_feature in trans_feature_str:
-                matching_cols.append(i)
-        mapping[orig_feature] = matching_cols
+    mapping = {orig_feature: [] for orig_feature in original_features}
+    for i, trans_feature in enumerate(transformed_features):
+        # Convertir trans_feature en string pour éviter l'erreur TypeError
+        trans_feature_str = str(trans_feature)
+        if trans_feature_str in mapping:
+            mapping[trans_feature_str].append(i)
+            continue
+        # Chercher le plus long préfixe correspondant à une variable originale
+        end = trans_feature_str.rfind("_")
+        while end > 0:
+            prefix = trans_feature_str[:end]
+            if prefix in mapping:
+                mapping[prefix].append(i)
+                break
+            end = trans_feature_str.rfind("_", 0, end)
     return mapping
 
 
-def group_shap_by_original_features(
-    shap_values: np.ndarray,
+def build_aggregation_matrix(
     feature_mapping: Dict[str, List[int]],
     original_features: List[str],
+    n_transformed: int,
+) -> Tuple[List[str], sparse.csr_matrix]:
+    """
+    Construit la matrice creuse d'agrégation des variables transformées vers les variables originales.
+
+    Paramètres:
+        feature_mapping: Mapping entre variables originales et indices transformés
+        original_features: Liste des noms des variables originales
+        n_transformed: Nombre de variables transformées
+
+    Retourne:
+        Liste des variables originales ayant au moins une variable transformée et matrice
+        (n_variables_originales, n_variables_transformees) contenant des 1 aux indices associés
+    """
+    grouped_features = []
+    rows, cols = [], []
+    for orig_feature in original_features:
+        col_indices = feature_mapping.get(orig_feature, [])
+        if len(col_indices) > 0:
+            rows.extend([len(grouped_features)] * len(col_indices))
+            cols.extend(col_indices)
+            grouped_features.append(orig_feature)
+
+    aggregation_matrix = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)),
+        shape=(len(grouped_features), n_transformed),
+    )
+    return grouped_features, aggregation_matrix
+
+
+def aggregate_shap_values(
+    shap_values: np.ndarray, aggregation_matrix: sparse.csr_matrix
+) -> np.ndarray:
+    """
+    Somme les valeurs SHAP des variables transformées par variable originale.
+    Paramètres:
+    shap_values: Array numpy des valeurs SHAP (n_samples, n_features)
+    aggregation_matrix: Matrice d'agrégation construite par build_aggregation_matrix
+    Retourne:
+    Array numpy des valeurs SHAP groupées (n_samples, n_variables_originales)
+    """
+    # Sommer les contributions des variables transformées en un seul produit matriciel
+    return (aggregation_matrix @ shap_values.T).T
+
+
+def aggregate_contributions(
+    contributions: np.ndarray, aggregation_matrix: sparse.csr_matrix
+) -> np.ndarray:
+    """
+    Somme par variable originale les contributions retournées par LightGBM (pred_contrib=True),
+    dont la dernière colonne (valeur de base) est ignorée.
+    Paramètres:
+    contributions: Array numpy des contributions (n_samples, n_features + 1)
+    aggregation_matrix: Matrice d'agrégation construite par build_aggregation_matrix
+    Retourne:
+    Array numpy des valeurs SHAP groupées (n_samples, n_variables_originales)
+    """
+    # Un seul produit dense avec une ligne nulle pour la valeur de base : les contributions ne sont
+    # pas recopiées sans leur dernière colonne, et le résultat est le seul tableau alloué
+    aggregation = np.zeros((contributions.shape[1], aggregation_matrix.shape[0]))
+    aggregation[:-1] = aggregation_matrix.T.toarray()
+    return contributions @ aggregation
+
+
+def group_shap_by_original_features(
+    shap_values: np.ndarray,
+    aggregation_matrix: sparse.csr_matrix,
+    grouped_features: List[str],
+    index: pd.Index = None,
 ) -> pd.DataFrame:
     """
     Groupe les valeurs SHAP par variables originales en sommant les contributions.
     Paramètres:
     shap_values: Array numpy des valeurs SHAP (n_samples, n_features)
-    feature_mapping: Mapping entre variables originales et indices transformés
-    original_features: Liste des noms des variables originales
+    aggregation_matrix: Matrice d'agrégation construite par build_aggregation_matrix
+    grouped_features: Liste des variables originales correspondant aux lignes de la matrice
+    index: Index à donner au DataFrame retourné (optionnel)
     Retourne:
     DataFrame avec les valeurs SHAP groupées par variable originale
     """
+    grouped_values = aggregate_shap_values(shap_values, aggregation_matrix)
 
-    # Calculer les valeurs shap pour chaque variable
-    shap_data = {}
-    for orig_feature in original_features:
-        if orig_feature in feature_mapping and len(feature_mapping[orig_feature]) > 0:
-            col_indices = feature_mapping[orig_feature]
-            if len(col_indices) == 1:
-                shap_data[orig_feature] = shap_values[:, col_indices[0]]
+    return pd.DataFrame(grouped_values, columns=grouped_features, index=index)
+
+
+def select_top_k(grouped_values: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sélectionne pour chaque client les k contributions SHAP les plus fortes en valeur absolue.
+    Paramètres:
+    grouped_values: Array numpy des valeurs SHAP groupées (n_samples, n_variables_originales)
+    k: Nombre de variables à retourner par client
+    Retourne:
+    Indices des variables et valeurs SHAP signées (n_samples, k), triés par |SHAP| décroissant
+    """
+    k = min(k, grouped_values.shape[1])
+
+    # Sélectionner les k plus fortes contributions en valeur absolue sans trier toute la ligne
+    abs_values = np.abs(grouped_values)
+    top_indices = np.argpartition(-abs_values, k - 1, axis=1)[:, :k]
+
+    # Trier ces k contributions par valeur absolue décroissante
+    order = np.argsort(-np.take_along_axis(abs_values, top_indices, axis=1), axis=1)
+    top_indices = np.take_along_axis(top_indices, order, axis=1)
+    top_values = np.take_along_axis(grouped_values, top_indices, axis=1)
+    return top_indices, top_values
+
+
+def top_k_shap(
+    grouped_values: np.ndarray,
+    grouped_features: List[str],
+    k: int,
+    index: pd.Index = None,
+) -> pd.DataFrame:
+    """
+    Sélectionne pour chaque client les k variables dont la contribution SHAP est la plus forte.
+    Paramètres:
+    grouped_values: Array numpy des valeurs SHAP groupées (n_samples, n_variables_originales)
+    grouped_features: Liste des variables originales correspondant aux colonnes
+    k: Nombre de variables à retourner par client
+    index: Index à donner au DataFrame retourné (optionnel)
+    Retourne:
+    DataFrame avec les colonnes VARIABLE_i et SHAP_i (valeur signée), triées par |SHAP| décroissant
+    """
+    top_indices, top_values = select_top_k(grouped_values, k)
+    top_features = np.asarray(grouped_features, dtype=object)[top_indices]
+
+    top_data = {}
+    for i in range(top_indices.shape[1]):
+        top_data[f"VARIABLE_{i + 1}"] = top_features[:, i]
+        top_data[f"SHAP_{i + 1}"] = top_values[:, i]
+    return pd.DataFrame(top_data, index=index)
+
+
+def parse_product_thresholds(value: str) -> Tuple[Tuple[str, float], ...]:
+    """
+    Lit les seuils par ligne de produit au format JSON, par exemple {"Revolving loans": 0.4}.
+    Paramètre: value: Objet JSON produit -> seuil (chaîne vide pour aucun seuil spécifique)
+    Retourne: Tuple de paires (produit, seuil), hashable pour servir de clé de regroupement des lots
+    """
+    thresholds = json.loads(value) if value.strip() else {}
+    if not isinstance(thresholds, dict):
+        raise ValueError(f"Les seuils par produit doivent être un objet JSON produit -> seuil: {value}")
+    for product, seuil in thresholds.items():
+        if not isinstance(seuil, (int, float)) or not 0 <= seuil <= 1:
+            raise ValueError(f"Seuil invalide pour le produit {product}: {seuil} (attendu entre 0 et 1)")
+    return tuple(sorted((product, float(seuil)) for product, seuil in thresholds.items()))
+
+
+def row_thresholds(
+    df: pd.DataFrame, seuil: float, product_thresholds: Tuple[Tuple[str, float], ...] = ()
+) -> Union[float, np.ndarray]:
+    """
+    Retourne le seuil de décision de chaque client : celui de sa ligne de produit s'il est défini,
+    seuil sinon.
+    Paramètres:
+    df: Données clients
+    seuil: Seuil des produits sans seuil spécifique
+    product_thresholds: Paires (produit, seuil) retournées par parse_product_thresholds
+    Retourne:
+    seuil lui-même sans seuil par produit, sinon un array numpy d'un seuil par client
+    """
+    if len(product_thresholds) == 0:
+        return seuil
+    return df[PRODUCT_COLUMN].map(dict(product_thresholds)).fillna(seuil).to_numpy(dtype=np.float64)
+
+
+def float32_buffer(n_rows: int, n_cols: int) -> np.ndarray:
+    """
+    Retourne un tableau float32 C-contigu (n_rows, n_cols) propre au thread courant, réutilisé
+    d'un lot à l'autre et réalloué seulement pour un lot plus grand ou un autre nombre de colonnes.
+    Son contenu est écrasé au lot suivant : les résultats ne doivent pas y faire référence.
+    """
+    buffer = getattr(_buffers, "array", None)
+    if buffer is None or buffer.shape[1] != n_cols or buffer.shape[0] < n_rows:
+        buffer = np.empty((n_rows, n_cols), dtype=np.float32)
+        _buffers.array = buffer
+    return buffer[:n_rows]
+
+
+def transform_float32(preprocessor: Pipeline, df: pd.DataFrame) -> np.ndarray:
+    """
+    Transforme df directement dans le tampon float32 du thread, un transformer du ColumnTransformer
+    à la fois, sans construire la matrice transformée float64 complète.
+
+    Paramètres:
+        preprocessor: Étapes du pipeline précédant le modèle (ModelBundle.preprocessor)
+        df: Données clients
+
+    Retourne:
+        np.ndarray: Matrice transformée float32 (n_samples, n_features), vue sur le tampon du thread
+    """
+    ct = preprocessor[-1] if len(preprocessor) == 1 else None
+    if not isinstance(ct, ColumnTransformer):
+        # Prétraitement plus complexe qu'un ColumnTransformer : transformer puis copier dans le tampon
+        X_transformed = preprocessor.transform(df)
+        out = float32_buffer(*X_transformed.shape)
+        out[:] = X_transformed.toarray() if sparse.issparse(X_transformed) else X_transformed
+        return out
+
+    # Écrire la sortie de chaque transformer dans ses colonnes de la matrice transformée
+    out = float32_buffer(len(df), max(block.stop for block in ct.output_indices_.values()))
+    for name, transformer, columns in ct.transformers_:
+        block = ct.output_indices_[name]
+        if block.start == block.stop:
+            # Transformer "drop" ou sans colonne
+            continue
+        columns = [ct.feature_names_in_[i] if isinstance(i, (int, np.integer)) else i for i in columns]
+        values = df[columns] if transformer == "passthrough" else transformer.transform(df[columns])
+        out[:, block] = values.toarray() if sparse.issparse(values) else values
+    return out
+
+
+def _is_nan(value) -> bool:
+    # Seul NaN est différent de lui-même : None n'est pas une valeur manquante pour scikit-learn
+    return value != value
+
+
+def _imputes_nan(transformer) -> bool:
+    """
+    Indique si transformer est un SimpleImputer ajusté qui remplace les NaN, sans indicateur.
+    """
+    return (
+        isinstance(transformer, SimpleImputer)
+        and not transformer.add_indicator
+        and isinstance(transformer.missing_values, float)
+        and np.isnan(transformer.missing_values)
+    )
+
+
+def one_hot_positions(transformer) -> Union[List[Tuple[object, Dict[object, int], int]], None]:
+    """
+    Précalcule un OneHotEncoder qui ignore les catégories inconnues, éventuellement précédé
+    d'un SimpleImputer sur les mêmes colonnes.
+
+    Retourne:
+        Pour chaque colonne, valeur remplaçant les NaN (None sans imputer), position de chaque
+        catégorie dans la sortie et position de la catégorie NaN (None si absente), ou None si
+        transformer n'est pas de cette forme
+    """
+    steps = [step for _, step in transformer.steps] if isinstance(transformer, Pipeline) else [transformer]
+    encoder = steps[-1]
+    if (
+        len(steps) > 2
+        or not isinstance(encoder, OneHotEncoder)
+        or encoder.handle_unknown != "ignore"
+        or encoder.drop is not None
+        or encoder.min_frequency is not None
+        or encoder.max_categories is not None
+        or np.dtype(encoder.dtype) != np.float64
+    ):
+        return None
+
+    fills = [None] * len(encoder.categories_)
+    if len(steps) == 2:
+        imputer = steps[0]
+        # Un imputer qui retire des colonnes vides à l'entraînement décale les catégories
+        if not _imputes_nan(imputer) or any(_is_nan(value) for value in imputer.statistics_):
+            return None
+        fills = list(imputer.statistics_)
+
+    lookups, offset = [], 0
+    for fill, categories in zip(fills, encoder.categories_):
+        positions = {category: offset + i for i, category in enumerate(categories) if not _is_nan(category)}
+        nan_positions = [offset + i for i, category in enumerate(categories) if _is_nan(category)]
+        lookups.append((fill, positions, nan_positions[0] if len(nan_positions) > 0 else None))
+        offset += len(categories)
+    return lookups
+
+
+class RecordPreprocessor:
+    """
+    Prétraitement précalculé du chemin à faible latence (predict_records), au résultat identique
+    à celui du pipeline : pour quelques lignes, le ColumnTransformer passe l'essentiel de son temps
+    dans les vérifications de scikit-learn plutôt que dans les calculs.
+
+    Chaque transformer du ColumnTransformer écrit directement dans la matrice transformée :
+    - SimpleImputer sur des colonnes numériques : NaN remplacés par les valeurs apprises ;
+    - OneHotEncoder (précédé ou non d'un SimpleImputer) : position de chaque catégorie précalculée ;
+    - autre transformer sur des colonnes texte (TargetEncoder par exemple) : résultat mis en cache
+      pour chaque combinaison de valeurs, au plus max_cached combinaisons ;
+    - autre transformer : appel direct de transform.
+    Un prétraitement plus complexe qu'un ColumnTransformer à sortie dense est délégué au pipeline.
+    """
+
+    def __init__(self, preprocessor: Pipeline, text_columns: List[str], max_cached: int = 10000):
+        self.preprocessor = preprocessor
+        self.max_cached = max_cached
+        self._steps = None
+        ct = preprocessor[-1] if len(preprocessor) == 1 else None
+        if not isinstance(ct, ColumnTransformer) or ct.sparse_output_:
+            return
+
+        text_columns = set(text_columns)
+        steps = []
+        for name, transformer, columns in ct.transformers_:
+            block = ct.output_indices_[name]
+            if block.start == block.stop:
+                # Transformer "drop" ou sans colonne
+                continue
+            columns = [ct.feature_names_in_[i] if isinstance(i, (int, np.integer)) else i for i in columns]
+            is_text = all(col in text_columns for col in columns)
+            if transformer == "passthrough":
+                if is_text:
+                    return
+                steps.append((block, columns, self._passthrough, None))
+            elif _imputes_nan(transformer) and transformer.statistics_.dtype.kind == "f":
+                fill = transformer.statistics_
+                if not transformer.keep_empty_features:
+                    # Colonnes entièrement vides à l'entraînement : retirées de la sortie par l'imputer
+                    kept = ~np.isnan(fill)
+                    columns, fill = [col for col, keep in zip(columns, kept) if keep], fill[kept]
+                steps.append((block, columns, self._impute, fill))
+            elif is_text and one_hot_positions(transformer) is not None:
+                steps.append((block, columns, self._one_hot, one_hot_positions(transformer)))
+            elif is_text:
+                steps.append((block, columns, self._cached, (transformer, {})))
             else:
-                # Plusieurs colonnes : somme des valeurs SHAP
-                shap_data[orig_feature] = shap_values[:, col_indices].sum(axis=1)
+                steps.append((block, columns, self._direct, transformer))
+        self._steps = steps
+        self._n_features = max(block.stop for block in ct.output_indices_.values())
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Transforme df comme preprocessor.transform.
+
+        Paramètre: df: Données clients aux types du schéma
+        Retourne: np.ndarray: Matrice transformée (n_samples, n_features)
+        """
+        if self._steps is None:
+            return self.preprocessor.transform(df)
+        out = np.zeros((len(df), self._n_features), dtype=np.float64)
+        for block, columns, encode, state in self._steps:
+            encode(df, columns, out[:, block], state)
+        return out
+
+    @staticmethod
+    def _passthrough(df, columns, out, _) -> None:
+        out[:] = df[columns].to_numpy(dtype=np.float64)
+
+    @staticmethod
+    def _impute(df, columns, out, fill) -> None:
+        values = df[columns].to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+        values[missing] = np.broadcast_to(fill, values.shape)[missing]
+        out[:] = values
 
-    return pd.DataFrame(shap_data)
+    @staticmethod
+    def _one_hot(df, columns, out, lookups) -> None:
+        # out vaut zéro au départ : une catégorie inconnue reste à zéro, comme avec handle_unknown="ignore"
+        rows, positions_found = [], []
+        values = df[columns].to_numpy(dtype=object)
+        for j, (fill, positions, nan_position) in enumerate(lookups):
+            for row, value in enumerate(values[:, j].tolist()):
+                if fill is not None and _is_nan(value):
+                    value = fill
+                position = nan_position if _is_nan(value) else positions.get(value)
+                if position is not None:
+                    rows.append(row)
+                    positions_found.append(position)
+        out[rows, positions_found] = 1.0
 
+    def _cached(self, df, columns, out, state) -> None:
+        transformer, cache = state
+        selected = df[columns]
+        keys = [
+            tuple(_NAN_KEY if _is_nan(value) else value for value in row)
+            for row in selected.to_numpy(dtype=object).tolist()
+        ]
+        cached_rows = [cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(cached_rows) if row is None]
+        if len(missing) > 0:
+            values = transformer.transform(selected.iloc[missing])
+            values = values.toarray() if sparse.issparse(values) else np.asarray(values, dtype=np.float64)
+            out[missing] = values
+            for i, row in zip(missing, values):
+                if len(cache) < self.max_cached:
+                    cache[keys[i]] = row
+        for i, row in enumerate(cached_rows):
+            if row is not None:
+                out[i] = row
 
-def predict(df, seuil):
+    @staticmethod
+    def _direct(df, columns, out, transformer) -> None:
+        values = transformer.transform(df[columns])
+        out[:] = values.toarray() if sparse.issparse(values) else values
+
+
+def predict(
+    df, seuil, bundle, explain="full", k=10, timings=None, lean=False, product_thresholds=(), transformed=None
+):
     """
     Prédit le risque de défaut de crédit et calcule les valeurs SHAP explicatives
     pour chaque variable et chaque prédiction.
     Paramètres:
     df (pd.DataFrame): Données clients
+    seuil (float): Seuil de probabilité au-delà duquel le client est prédit en défaut
+    bundle (ModelBundle): Modèle préchargé (pipeline, explainer et métadonnées des variables)
+    explain (str): "none" sans valeurs SHAP, "topk" pour les k plus fortes contributions,
+        "full" pour les valeurs SHAP de toutes les variables
+    k (int): Nombre de variables retournées avec explain="topk"
+    timings (dict): Si fourni, reçoit la durée (s) de chaque étape : preprocess, predict,
+        shap_values et shap_grouping
+    lean (bool): Mode économe en mémoire : matrice transformée float32 dans un tampon réutilisé,
+        transmise telle quelle au booster LightGBM, qui calcule aussi les valeurs SHAP (pred_contrib)
+    product_thresholds (tuple): Seuils par ligne de produit remplaçant seuil (voir row_thresholds)
+    transformed (dict): Si fourni, reçoit la matrice transformée sous la clé bundle.preprocessing_key,
+        pour la réutiliser avec d'autres versions du modèle (voir predict_versions)
     Retourne:
     pd.DataFrame: Prédictions (probabilité, classe) et valeurs SHAP par variable originale
     """
-    # Mettre l'ID du demandeur de prêt en index
-    df = df.set_index("SK_ID_CURR").copy()
+    if explain not in EXPLAIN_MODES:
+        raise ValueError(f"Mode d'explication inconnu: {explain} (attendu: {', '.join(EXPLAIN_MODES)})")
 
-    # Charger le pipeline contenant les étapes de preprocessing et le modèle depuis ML Flow
-    pipe = mlflow.sklearn.load_model("models:/Defaut_Credit_LGBM_Pipeline_VF/latest")
+    # Récupérer l'ID du demandeur de prêt pour indexer les résultats
+    index = pd.Index(df["SK_ID_CURR"], name="SK_ID_CURR")
+
+    # Transformer X une seule fois : le ColumnTransformer ignore la colonne SK_ID_CURR
+    with span(timings, "preprocess"):
+        if lean:
+            X_transformed = transform_float32(bundle.preprocessor, df)
+        else:
+            X_transformed = bundle.preprocessor.transform(df)
+    if transformed is not None:
+        # Copier le tampon du mode économe, réutilisé par le lot suivant du thread
+        transformed[bundle.preprocessing_key] = X_transformed.copy() if lean else X_transformed
 
     # Effectuer la prédiction en récupérant les probabilités
-    y_pred_df = pd.DataFrame(index=df.index)
-    y_pred_df["PROBA_DEFAUT"] = pipe.predict_proba(df)[:, 1]
-    y_pred_df["PRED_DEFAUT"] = 0
-    y_pred_df.loc[y_pred_df["PROBA_DEFAUT"] > seuil, "PRED_DEFAUT"] = 1
+    with span(timings, "predict"):
+        if lean:
+            # Le booster lit directement la matrice float32, sans copie ni vérifications scikit-learn
+            proba = bundle.model.booster_.predict(X_transformed)
+        else:
+            proba = bundle.model.predict_proba(X_transformed)[:, 1]
+        pred = (proba > row_thresholds(df, seuil, product_thresholds)).astype(np.int64)
+
+    # Sans explication, le calcul des valeurs SHAP est entièrement évité
+    if explain == "none":
+        return pd.DataFrame({"PROBA_DEFAUT": proba, "PRED_DEFAUT": pred}, index=index)
+
+    # Calculer les valeurs SHAP pour chaque prédiction sur la même matrice transformée
+    with span(timings, "shap_values"):
+        if lean:
+            # TreeSHAP de LightGBM (celui qu'utilise l'explainer) sur la matrice float32, sans la
+            # conversion en float64 de shap ; la dernière colonne contient la valeur de base
+            shap_values = bundle.model.booster_.predict(X_transformed, pred_contrib=True)
+        else:
+            shap_values = bundle.explainer.shap_values(X_transformed)
+
+    with span(timings, "shap_grouping"):
+        if lean:
+            grouped_values = aggregate_contributions(shap_values, bundle.aggregation_matrix)
+            if explain == "topk":
+                resultat_df = top_k_shap(grouped_values, bundle.grouped_features, k, index=index)
+            else:
+                resultat_df = pd.DataFrame(grouped_values, columns=bundle.grouped_features, index=index)
+        elif explain == "topk":
+            # Ne garder que les k plus fortes contributions sans construire le DataFrame complet
+            grouped_values = aggregate_shap_values(shap_values, bundle.aggregation_matrix)
+            resultat_df = top_k_shap(grouped_values, bundle.grouped_features, k, index=index)
+        else:
+            # Récupérer les valeurs SHAP groupées par variables originales
+            resultat_df = group_shap_by_original_features(
+                shap_values, bundle.aggregation_matrix, bundle.grouped_features, index=index
+            )
 
-    # Récupérer le nom des variables transformées
-    ct = pipe["columntransformer"]
-    transformed_features = get_feature_names_from_column_transformer(ct, df.columns)
+        # Ajouter les prédictions en tête des valeurs shap par variable
+        resultat_df.insert(0, "PRED_DEFAUT", pred)
+        resultat_df.insert(0, "PROBA_DEFAUT", proba)
 
-    # Récupérer le mapping entre variables originales et variables transformées
-    feature_mapping = create_feature_mapping(df.columns, transformed_features)
+    return resultat_df
 
-    # Récupérer le modèle
-    model = pipe.named_steps["lgbmclassifier"]
 
-    # Transformer X
-    X_transformed = pipe[:-1].transform(df)
+def predict_records(
+    df, seuil, bundle, explain="full", k=10, timings=None, product_thresholds=(), transformed=None
+):
+    """
+    Variante de predict pour quelques clients à faible latence : le booster LightGBM est
+    appelé directement et les résultats sont construits sous forme de dictionnaires,
+    sans DataFrame intermédiaire.
+    Paramètres:
+    df (pd.DataFrame): Données clients aux types du schéma (par exemple SCHEMA.frame_from_records)
+    seuil, bundle, explain, k, timings, product_thresholds, transformed: Voir predict
+    Retourne:
+    List[Dict]: Un dictionnaire par client, avec les mêmes clés que les lignes de predict
+    """
+    if explain not in EXPLAIN_MODES:
+        raise ValueError(f"Mode d'explication inconnu: {explain} (attendu: {', '.join(EXPLAIN_MODES)})")
 
-    # Créer l'explainer avec le modèle
-    explainer = shap.TreeExplainer(model)
+    # Transformer X une seule fois avec le prétraitement précalculé, puis prédire avec le booster,
+    # sans la surcouche scikit-learn
+    with span(timings, "preprocess"):
+        X_transformed = bundle.record_preprocessor.transform(df)
+    if transformed is not None:
+        transformed[bundle.preprocessing_key] = X_transformed
+    with span(timings, "predict"):
+        proba = bundle.model.booster_.predict(X_transformed)
+        pred = (proba > row_thresholds(df, seuil, product_thresholds)).astype(np.int64)
+        records = [
+            {"SK_ID_CURR": id_client, "PROBA_DEFAUT": p, "PRED_DEFAUT": d}
+            for id_client, p, d in zip(df["SK_ID_CURR"].tolist(), proba.tolist(), pred.tolist())
+        ]
+    if explain == "none":
+        return records
 
-    # Calculer les valeurs SHAP pour chaque prédiction
-    shap_values = explainer.shap_values(X_transformed)
+    # Calculer et grouper les valeurs SHAP sur la même matrice transformée
+    with span(timings, "shap_values"):
+        shap_values = bundle.explainer.shap_values(X_transformed)
 
-    # Récupérer les valeurs SHAP groupées par variables originales
-    shap_df = group_shap_by_original_features(
-        shap_values, feature_mapping, df.columns
-    ).set_index(df.index)
+    with span(timings, "shap_grouping"):
+        grouped_values = aggregate_shap_values(shap_values, bundle.aggregation_matrix)
+        if explain == "topk":
+            top_indices, top_values = select_top_k(grouped_values, k)
+            for record, indices, values in zip(records, top_indices.tolist(), top_values.tolist()):
+                for i, (feature_index, value) in enumerate(zip(indices, values)):
+                    record[f"VARIABLE_{i + 1}"] = bundle.grouped_features[feature_index]
+                    record[f"SHAP_{i + 1}"] = value
+        else:
+            for record, values in zip(records, grouped_values.tolist()):
+                record.update(zip(bundle.grouped_features, values))
 
-    # Joindre les prédictions aux valeurs shap par variable
-    resultat_df = y_pred_df.merge(
-        shap_df, left_index=True, right_index=True, how="left"
-    )
+    return records
 
-    return resultat_df
+
+def predict_versions(
+    df, seuil, bundles, product_thresholds=(), transformed=None, timings=None
+):
+    """
+    Prédit le risque de défaut avec plusieurs versions du modèle en ne transformant les données
+    qu'une fois par prétraitement : les versions dont le prétraitement ajusté est identique
+    (même ModelBundle.preprocessing_key) partagent la même matrice transformée.
+    Paramètres:
+    df (pd.DataFrame): Données clients
+    seuil, product_thresholds, timings: Voir predict
+    bundles (List[ModelBundle]): Versions du modèle à évaluer
+    transformed (dict): Matrices transformées déjà calculées (par exemple par predict), par clé de
+        prétraitement ; complété avec celles calculées ici
+    Retourne:
+    pd.DataFrame: Une ligne par client et par version : SK_ID_CURR, MODEL_VERSION, PROBA_DEFAUT,
+        PRED_DEFAUT et SEUIL appliqué
+    """
+    transformed = {} if transformed is None else transformed
+    seuils = np.broadcast_to(row_thresholds(df, seuil, product_thresholds), (len(df),))
+    ids = df["SK_ID_CURR"].to_numpy()
+
+    frames = []
+    for bundle in bundles:
+        # Ne transformer qu'une fois par prétraitement distinct
+        X_transformed = transformed.get(bundle.preprocessing_key)
+        if X_transformed is None:
+            with span(timings, "preprocess"):
+                X_transformed = bundle.preprocessor.transform(df)
+            transformed[bundle.preprocessing_key] = X_transformed
+
+        with span(timings, "predict"):
+            proba = bundle.model.booster_.predict(X_transformed)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "SK_ID_CURR": ids,
+                    "MODEL_VERSION": bundle.version,
+                    "PROBA_DEFAUT": proba,
+                    "PRED_DEFAUT": (proba > seuils).astype(np.int64),
+                    "SEUIL": seuils,
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)